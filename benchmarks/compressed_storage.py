@@ -0,0 +1,77 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+"""
+Compares the disk footprint and allocation latency of block-compressed
+number files against the plain-text files read by the
+ThirdPartyProcessingClass.
+
+    python -m benchmarks.compressed_storage --lines 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from list_based_flavorpack.storage import blocks, index
+
+
+def footprint(*paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def time_reads(read, file_path, line_count, size, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        read(file_path, random.randint(1, line_count - size + 1), size)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--block-size', type=int,
+                        default=blocks.DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 10000])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        plain_path = os.path.join(directory, 'plain')
+        with open(plain_path, 'w') as f:
+            f.writelines('%s\n' % uuid.uuid1() for i in range(args.lines))
+        index.sync_index(plain_path)
+        files = {'plain': (index.read_lines, plain_path,
+                           footprint(plain_path,
+                                     index.get_index_path(plain_path)))}
+        for codec in sorted(blocks.CODECS):
+            path = os.path.join(directory, codec)
+            blocks.convert_file(plain_path, path, args.block_size, codec)
+            files[codec] = (blocks.read_lines, path,
+                            footprint(path, blocks.get_block_index_path(path)))
+
+        print('%-8s %14s' % ('format', 'bytes on disk') + ''.join(
+            ' %12s' % ('ms/%s' % size) for size in args.sizes))
+        for name, (read, path, size_on_disk) in files.items():
+            print('%-8s %14d' % (name, size_on_disk) + ''.join(
+                ' %12.3f' % time_reads(read, path, args.lines, size,
+                                       args.iterations)
+                for size in args.sizes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+"""
+Hammers a single flat-file region from several worker processes and
+reports allocation throughput and the number of serials issued more
+than once, for the previous read-then-save cursor and for the
+reserve-first cursor of ThirdPartyProcessingClass.get_items.
+
+    python -m benchmarks.cursor_contention --workers 1 4 8 --allocations 200
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+from django.conf import settings
+
+DIRECTORY = tempfile.mkdtemp()
+# worker processes need a database they can share.
+settings.DATABASES['default']['NAME'] = os.path.join(DIRECTORY, 'bench.db')
+settings.DATABASES['default']['OPTIONS'] = {'timeout': 60}
+django.setup()
+
+from django.core.management import call_command
+from django.db import connections
+from serialbox import models as sb_models
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.processing_classes.third_party_processing.processing import \
+    ThirdPartyProcessingClass
+from list_based_flavorpack.storage import appender
+from list_based_flavorpack.storage.locks import lock_file
+
+
+class ReadThenSaveProcessingClass(ThirdPartyProcessingClass):
+    """
+    The cursor handling get_items used before ranges were reserved first.
+    """
+
+    def get_items(self, region, size):
+        with lock_file(region.lock_file_path, shared=True):
+            region.refresh_from_db(fields=['file_id', 'last_number_line'])
+            first = region.last_number_line
+            lines = self.read_lines(region, first, size)
+            region.last_number_line = first + size
+            region.save(update_fields=['last_number_line'])
+        return lines
+
+
+def create_region(name, line_count):
+    pool = sb_models.Pool.objects.create(readable_name=name,
+                                         machine_name=name, active=True,
+                                         request_threshold=1000000)
+    region = ListBasedRegion.objects.create(
+        readable_name=name, machine_name=name, pool=pool, active=True,
+        order=1, directory_path=DIRECTORY,
+        processing_class_path='list_based_flavorpack.processing_classes.'
+                              'third_party_processing.processing.'
+                              'ThirdPartyProcessingClass')
+    open(region.file_path, 'a').close()
+    appender.append_lines(region.file_path,
+                          (uuid.uuid1() for i in range(line_count)))
+    return region
+
+
+def work(processing_class, region_pk, allocations, size, results):
+    connections.close_all()
+    region = ListBasedRegion.objects.get(pk=region_pk)
+    numbers = []
+    for i in range(allocations):
+        numbers.extend(processing_class().get_items(region, size))
+    results.put(numbers)
+
+
+def run(processing_class, workers, allocations, size):
+    region = create_region('%s_%s' % (processing_class.__name__, workers),
+                           workers * allocations * size)
+    connections.close_all()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=work,
+        args=(processing_class, region.pk, allocations, size, results))
+        for i in range(workers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    numbers = []
+    for process in processes:
+        numbers.extend(results.get())
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    duplicates = sum(count - 1 for count in Counter(numbers).values()
+                     if count > 1)
+    return workers * allocations / elapsed, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 4, 8])
+    parser.add_argument('--allocations', type=int, default=200)
+    parser.add_argument('--size', type=int, default=50)
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    multiprocessing.set_start_method('fork')
+    print('%8s %24s %14s %12s' % ('workers', 'cursor', 'allocations/s',
+                                  'duplicates'))
+    for workers in args.workers:
+        for name, processing_class in (
+                ('read-then-save', ReadThenSaveProcessingClass),
+                ('reserve-first', ThirdPartyProcessingClass)):
+            rate, duplicates = run(processing_class, workers,
+                                   args.allocations, args.size)
+            print('%8d %24s %14.1f %12d' % (workers, name, rate,
+                                             duplicates))
+    shutil.rmtree(DIRECTORY)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+"""
+Compares DBProcessingClass.get_items against the previous
+one-DELETE-per-number implementation.
+
+    python -m benchmarks.db_claim --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+from list_based_flavorpack.processing_classes.third_party_processing.processing import \
+    DBProcessingClass
+from list_based_flavorpack.processing_classes.third_party_processing.rules import \
+    get_region_table
+
+
+def per_row_get_items(region, size):
+    connection = sqlite3.connect(region.db_file_path)
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT serial_number FROM %s WHERE used = 0 LIMIT ?" %
+        get_region_table(region), (size,))
+    rows = cursor.fetchall()
+    lines = []
+    for row in rows:
+        lines.append(row[0])
+        cursor.execute('DELETE FROM %s WHERE serial_number = ?'
+                       % get_region_table(region), (row[0],))
+    connection.commit()
+    connection.close()
+    return lines
+
+
+def fill(region, count):
+    connection = sqlite3.connect(region.db_file_path)
+    connection.execute(
+        "create table if not exists %s "
+        "(serial_number text not null unique, used integer not null)"
+        % get_region_table(region))
+    connection.executemany(
+        'insert into %s (serial_number, used) values (?, 0)' %
+        get_region_table(region),
+        ((str(uuid.uuid1()),) for i in range(count)))
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--allocations', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%10s %14s %14s' % ('size', 'per-row ms', 'claim ms'))
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            results = []
+            for name, get_items in (
+                    ('per_row', per_row_get_items),
+                    ('claim', DBProcessingClass().get_items)):
+                region = SimpleNamespace(
+                    database_name='%s_%s' % (name, size),
+                    get_processing_parameters=dict,
+                    get_processing_parameter=lambda key, default=None: default,
+                    db_file_path=os.path.join(directory,
+                                              '%s_%s.db' % (name, size)),
+                    lock_file_path=os.path.join(directory,
+                                                '%s_%s.lock' % (name, size)))
+                fill(region, size * args.allocations)
+                start = time.perf_counter()
+                for i in range(args.allocations):
+                    assert len(get_items(region, size)) == size
+                results.append((time.perf_counter() - start) /
+                               args.allocations * 1000)
+            print('%10d %14.2f %14.2f' % (size, results[0], results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+"""
+Measures replenishment and allocation throughput of a DB region under
+each of the LIST_BASED_SQLITE_PROFILES tuning profiles.
+
+    python -m benchmarks.sqlite_profiles --replenishments 20 --size 10000
+
+With the defaults (20 replenishments of 10000, allocations of 100):
+
+     profile   replenish rows/s      allocations/s
+     default             174067             3784.9
+     durable             161820             3433.6
+    rollback              86568               17.9
+  throughput             170915             5945.9
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+django.setup()
+
+from list_based_flavorpack import list_based_flavorpack_settings as settings
+from list_based_flavorpack.processing_classes.third_party_processing.processing import \
+    DBProcessingClass
+from list_based_flavorpack.processing_classes.third_party_processing.rules import \
+    get_db_number_count, get_region_table
+from list_based_flavorpack.storage import sqlite
+
+
+def replenish(region, size):
+    sqlite.insert_numbers(sqlite.get_region_connection(region),
+                          get_region_table(region),
+                          (uuid.uuid1() for i in range(size)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--replenishments', type=int, default=20)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--allocation-size', type=int, default=100)
+    args = parser.parse_args()
+
+    allocations = args.replenishments * args.size // args.allocation_size
+    print('%12s %18s %18s' % ('profile', 'replenish rows/s',
+                              'allocations/s'))
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ['default'] + sorted(settings.SQLITE_PROFILES):
+            params = {'sqlite_profile': profile} \
+                if profile != 'default' else {}
+            region = SimpleNamespace(
+                database_name=profile,
+                db_file_path=os.path.join(directory, profile + '.db'),
+                lock_file_path=os.path.join(directory, profile + '.lock'),
+                get_processing_parameters=lambda params=params: params,
+                get_processing_parameter=params.get)
+            get_db_number_count(region)
+            start = time.perf_counter()
+            for i in range(args.replenishments):
+                replenish(region, args.size)
+            replenish_rate = (args.replenishments * args.size /
+                              (time.perf_counter() - start))
+            processing_class = DBProcessingClass()
+            start = time.perf_counter()
+            for i in range(allocations):
+                processing_class.get_items(region, args.allocation_size)
+            allocation_rate = allocations / (time.perf_counter() - start)
+            sqlite.close_connection(region.db_file_path)
+            print('%12s %18.0f %18.1f' % (profile, replenish_rate,
+                                          allocation_rate))
+
+
+if __name__ == '__main__':
+    main()
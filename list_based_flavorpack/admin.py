@@ -44,5 +44,16 @@ class ListBasedRegionAdmin(admin.ModelAdmin):
                      'pool__machine_name']
 
 
+class PoolAllocationStrategyAdmin(admin.ModelAdmin):
+    list_display = (
+        'pool',
+        'strategy'
+    )
+    search_fields = ['pool__readable_name',
+                     'pool__machine_name']
+
+
 def register_to_site(admin_site):
     admin_site.register(models.ListBasedRegion, ListBasedRegionAdmin)
+    admin_site.register(models.PoolAllocationStrategy,
+                        PoolAllocationStrategyAdmin)
@@ -58,4 +58,9 @@ urlpatterns = [
         views.CloneListBasedFlavorpackView.as_view(),
         name="clone-pool-view",
     ),
+    re_path(
+        r"^batch-allocate/$",
+        views.BatchAllocateView.as_view(),
+        name="batch-allocate",
+    ),
 ] + router_urlpatterns
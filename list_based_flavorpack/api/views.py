@@ -17,9 +17,14 @@
     along with RandomFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import coreapi, coreschema
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.schemas import ManualSchema
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from serialbox.api import serializers as sb_serializers
+from serialbox.api.views import AllocationPermission
+from list_based_flavorpack import batch
 from list_based_flavorpack.models import ListBasedRegion
 from list_based_flavorpack.utils import clone_list_based_pool
 
@@ -51,3 +56,44 @@ class CloneListBasedFlavorpackView(APIView):
         if machine_name and new_machine_name:
             clone_list_based_pool(machine_name, new_machine_name)
             return Response("The pool was copied.")
+
+
+class BatchAllocateView(APIView):
+    """
+    Allocates numbers from several list-based regions in one request.
+    Post a JSON object of region machine names and sizes, e.g.
+    `{"item-region": 500, "case-region": 50}`.  The response has an entry
+    per region holding either the serialized allocation or an `error`
+    and its `status_code`; one failing region does not fail the others.
+    Response rules are not applied to batch allocations.
+    """
+    queryset = ListBasedRegion.objects.none()
+    permission_classes = (IsAuthenticated, AllocationPermission)
+
+    def post(self, request):
+        sizes = request.data
+        if not isinstance(sizes, dict) or not sizes:
+            raise ValidationError(
+                "Expected an object of region machine names and sizes.")
+        for machine_name, size in sizes.items():
+            if isinstance(size, bool) or not isinstance(size, int) or \
+                    size < 1:
+                raise ValidationError(
+                    "The size for region %s must be a positive "
+                    "integer." % machine_name)
+        ret = {}
+        for machine_name, result in batch.allocate(request, sizes).items():
+            if isinstance(result, Exception):
+                if isinstance(result, APIException):
+                    status_code = result.status_code
+                    detail = str(result.detail)
+                else:
+                    status_code = APIException.status_code
+                    detail = str(result) or repr(result)
+                ret[machine_name] = {'error': detail,
+                                     'status_code': status_code}
+            else:
+                result.save()
+                ret[machine_name] = sb_serializers.ResponseSerializer(
+                    result).data
+        return Response(ret)
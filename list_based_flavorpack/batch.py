@@ -0,0 +1,106 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+
+    Allocates from several list-based regions in one call.  The regions,
+    their pools and processing parameters are loaded up front, one
+    generator serves all of them and each region is allocated
+    independently, so one failing region does not fail the others.
+'''
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection, connections
+from rest_framework.exceptions import NotFound
+
+from list_based_flavorpack import list_based_flavorpack_settings as settings
+from list_based_flavorpack.generators.list_based import ListBasedGenerator
+from list_based_flavorpack.models import ListBasedRegion
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BATCH_ALLOCATION_WORKERS,
+                thread_name_prefix='list-based-batch')
+    return _executor
+
+
+def runs_concurrently():
+    '''
+    Whether the regions of a batch are allocated on separate threads.
+    Every allocation writes to the main database, so with SQLite, which
+    allows a single writer, they are allocated one at a time instead.
+    '''
+    return settings.BATCH_ALLOCATION_WORKERS > 1 and \
+        connection.vendor != 'sqlite'
+
+
+def allocate(request, sizes):
+    '''
+    Allocates `size` numbers from each region in `sizes`.
+    :param request: The HTTP request the allocations are made for.
+    :param sizes: A dictionary of region machine names and sizes.
+    :return: A dictionary of region machine names and either the unsaved
+        serialbox Response or the exception raised by the allocation.
+    '''
+    regions = {region.machine_name: region for region in
+               ListBasedRegion.objects.select_related(
+                   'pool').prefetch_related('processing_parameters').filter(
+                   machine_name__in=list(sizes), active=True,
+                   pool__active=True)}
+    generator = ListBasedGenerator()
+    results = {}
+    jobs = []
+    for machine_name, size in sizes.items():
+        region = regions.get(machine_name)
+        if region is None:
+            results[machine_name] = NotFound(
+                "SerialBox could not find an active list-based region with "
+                "the machine name %s." % machine_name)
+        else:
+            jobs.append((machine_name, region, size))
+    if len(jobs) > 1 and runs_concurrently():
+        futures = [(machine_name, _get_executor().submit(
+            _run, generator, request, region, size, True))
+            for machine_name, region, size in jobs]
+        for machine_name, future in futures:
+            results[machine_name] = future.result()
+    else:
+        for machine_name, region, size in jobs:
+            results[machine_name] = _run(generator, request, region, size)
+    return {machine_name: results[machine_name] for machine_name in sizes}
+
+
+def _run(generator, request, region, size, threaded=False):
+    try:
+        return generator.allocate(request, size, region)
+    except Exception as e:
+        logger.exception('Batch allocation from region %s failed.',
+                         region.machine_name)
+        return e
+    finally:
+        if threaded:
+            connections.close_all()
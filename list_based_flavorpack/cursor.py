@@ -0,0 +1,178 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import struct
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.storage.locks import locked
+
+# The journal holds the cursor value after each reservation and is
+# written before any reserved numbers leave the process.  If the
+# database ever comes back with a cursor lower than the journal (e.g. a
+# commit lost in a crash) the first reservation a process makes for the
+# region starts past the journal instead of issuing the same numbers
+# twice.  Remove the journal when
+# resetting a region's last number line by hand.
+ENTRY = struct.Struct('<Q')
+JOURNAL_MAX_ENTRIES = 4096
+
+# The regions whose journal this process has recovered.
+_recovered = set()
+
+
+def get_journal_path(region):
+    return os.path.join(region.directory_path,
+                        '%s.journal' % region.database_name)
+
+
+def uses_journal(region):
+    '''
+    Returns True if the region's `cursor_mode` processing parameter is
+    set to journal.
+    '''
+    return region.get_processing_parameter('cursor_mode') == 'journal'
+
+
+def _supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def advance_cursor(region, size, limit=None):
+    '''
+    Adds `size` to the region's last number line with a single-column
+    UPDATE and returns the new value.  Uses UPDATE ... RETURNING where the
+    database supports it.  If `limit` is given the cursor is only
+    advanced if its new value would not exceed it; None is returned if
+    it would.
+    '''
+    if _supports_update_returning():
+        quote = connection.ops.quote_name
+        opts = ListBasedRegion._meta
+        column = quote(opts.get_field('last_number_line').column)
+        sql = 'UPDATE %s SET %s = %s + %%s WHERE %s = %%s' % (
+            quote(opts.db_table), column, column, quote(opts.pk.column))
+        params = [size, region.pk]
+        if limit is not None:
+            sql += ' AND %s + %%s <= %%s' % column
+            params += [size, limit]
+        with connection.cursor() as cursor:
+            cursor.execute('%s RETURNING %s' % (sql, column), params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+    regions = ListBasedRegion.objects.filter(pk=region.pk)
+    if limit is not None:
+        regions = regions.filter(last_number_line__lte=limit - size)
+    with transaction.atomic():
+        if not regions.update(last_number_line=F('last_number_line') + size):
+            return None
+        return ListBasedRegion.objects.filter(pk=region.pk).values_list(
+            'last_number_line', flat=True).get()
+
+
+def _read_high_water_mark(journal):
+    size = os.fstat(journal.fileno()).st_size
+    if size < ENTRY.size:
+        return 0
+    journal.seek(size - size % ENTRY.size - ENTRY.size)
+    return ENTRY.unpack(journal.read(ENTRY.size))[0]
+
+
+def _append_entry(journal, last_number_line):
+    if os.fstat(journal.fileno()).st_size >= (
+            JOURNAL_MAX_ENTRIES * ENTRY.size):
+        journal.truncate(0)
+    journal.write(ENTRY.pack(last_number_line))
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def recover(region):
+    '''
+    Moves the region's last number line up to the journal's high-water
+    mark if the database has fallen behind it.  The update only ever
+    raises the cursor so it is safe to run alongside allocations.
+    `reserve` calls it the first time a process reserves lines for the
+    region.
+    '''
+    os.makedirs(region.directory_path, exist_ok=True)
+    with open(get_journal_path(region), 'a+b') as journal:
+        with locked(journal):
+            high_water_mark = _read_high_water_mark(journal)
+            ListBasedRegion.objects.filter(
+                pk=region.pk, last_number_line__lt=high_water_mark).update(
+                last_number_line=high_water_mark)
+    _recovered.add(region.pk)
+
+
+def reserve(region, size, limit=None):
+    '''
+    Reserves `size` lines for the region with `advance_cursor` and returns
+    the first one, or None if the cursor would pass `limit`.  The new
+    cursor is journaled and fsynced before the reserved lines are read.
+    Sets the region's last number line to the new value.
+    '''
+    if region.pk not in _recovered:
+        recover(region)
+    last_number_line = advance_cursor(region, size, limit)
+    if last_number_line is None:
+        return None
+    with open(get_journal_path(region), 'a+b') as journal:
+        with locked(journal):
+            _append_entry(journal, max(last_number_line,
+                                       _read_high_water_mark(journal)))
+    region.last_number_line = last_number_line
+    return last_number_line - size
+
+
+def release(region, first, size):
+    '''
+    Gives back lines reserved with `reserve` or `advance_cursor` that
+    could not be issued, unless another allocation has reserved lines
+    since.  Returns True if they were given back.
+    '''
+    regions = ListBasedRegion.objects.filter(pk=region.pk,
+                                             last_number_line=first + size)
+    if uses_journal(region):
+        with open(get_journal_path(region), 'a+b') as journal:
+            with locked(journal):
+                released = regions.update(last_number_line=first)
+                if released and _read_high_water_mark(
+                        journal) == first + size:
+                    _append_entry(journal, first)
+    else:
+        released = regions.update(last_number_line=first)
+    if released:
+        region.last_number_line = first
+    return bool(released)
+
+
+def reset_journal(region):
+    '''
+    Removes the region's journal.  Must be called with the region's lock
+    held exclusively whenever its last number line is moved backwards.
+    '''
+    if os.path.exists(get_journal_path(region)):
+        os.remove(get_journal_path(region))
@@ -16,17 +16,37 @@
     You should have received a copy of the GNU Affero General Public License
     along with ListBasedFlavorpack. If not, see <http://www.gnu.org/licenses/>.
 '''
+import time
+import uuid
+from functools import lru_cache
+from rest_framework.exceptions import NotFound
+from serialbox.discovery import get_region
+from serialbox.generators import logger, errors
 from serialbox.generators.common import Generator
+from serialbox.models import Pool, Response
 from serialbox.rules.common import PreprocessingRule
+from serialbox.rules.errors import RuleError
+from list_based_flavorpack import prefetch, replenishment, strategies
+from list_based_flavorpack.models import ListBasedRegion, \
+    PoolAllocationStrategy
 from list_based_flavorpack import list_based_flavorpack_settings as settings
+from list_based_flavorpack.processing_classes.third_party_processing.rules \
+    import InsufficientNumbersError
+from list_based_flavorpack.storage import archive
 
 def import_processing_class(region):
     '''
     Returns the processing class dynamically.
     A processing class is entered when creating a list-based region
-    and is used for all rules/generator logic.
+    and is used for all rules/generator logic.  Classes are imported
+    once per process.
     '''
-    package_path = region.processing_class_path.split(".")
+    return _import_class(region.processing_class_path)
+
+
+@lru_cache(maxsize=None)
+def _import_class(processing_class_path):
+    package_path = processing_class_path.split(".")
     class_path = package_path[:-1]
     class_name = package_path[-1]
     processing_module = __import__(".".join(class_path), fromlist=[class_name])
@@ -37,16 +57,144 @@ class ListBasedGenerator(Generator):
     '''
     Generates a list of numbers (or anything else located in source)
     '''
+    def get_response(self, request, size, pool, region=None):
+        '''
+        Same as the SerialBox implementation except that the region is
+        not saved once the numbers are generated.  Processing classes
+        persist their own state and a full save of the (possibly stale)
+        region here could undo changes made in the meantime by other
+        requests or by compaction.  Requests that don't name a region
+        are served according to the pool's PoolAllocationStrategy.
+        '''
+        self.pool = self._get_pool(request, pool)
+        if region:
+            return self.allocate(request, size,
+                                 self._get_region(self.pool, region))
+        strategy = strategies.get_strategy(self.pool)
+        if strategy == PoolAllocationStrategy.FIRST:
+            return self.allocate(request, size, get_region(self.pool))
+        ranked = strategies.rank_regions(self.pool, size, strategy,
+                                         import_processing_class)
+        if strategy != PoolAllocationStrategy.FAILOVER:
+            return self.allocate(request, size, ranked[0][0])
+        return self._failover(request, size, ranked)
+
+    def _failover(self, request, size, ranked):
+        '''
+        Allocates from the first ready region that doesn't fail before
+        issuing any numbers, i.e. with a RuleError from its pre-processing
+        rules or an InsufficientNumbersError.  Failures after numbers have
+        been issued are raised rather than retried elsewhere.
+        '''
+        error = None
+        for region, available in ranked:
+            if available < size:
+                # no ready region could serve it; wait on a replenishment.
+                return self.allocate(request, size, region)
+            try:
+                response = self._generate_response(request, size, region)
+            except (RuleError, InsufficientNumbersError) as e:
+                logger.warning('Allocation from region %s failed, failing '
+                               'over to the next region.', region,
+                               exc_info=True)
+                error = e
+                continue
+            self._execute_post_processing_rules(request, response,
+                                                size, region.pool, region)
+            return response
+        raise error
+
+    def allocate(self, request, size, region):
+        '''
+        Runs the rules and processing class of an already loaded region
+        (with its pool) and returns the unsaved response.  Does not touch
+        the generator's state, so one generator can allocate from several
+        regions at once.
+        '''
+        response = self._generate_response(request, size, region)
+        self._execute_post_processing_rules(request, response,
+                                            size, region.pool, region)
+        return response
+
+    def _generate_response(self, request, size, region):
+        logger.debug('Using region %s', region)
+        response = Response(region=str(region.machine_name),
+                            pool=str(region.pool.machine_name),
+                            size_granted=size, fulfilled=True,
+                            remote_host=request.get_host())
+        self._execute_pre_processing_rules(request, size, region.pool,
+                                           region)
+        self.generate(request, response, region, size)
+        return response
+
     def generate(self, request, response, region, size):
         '''
-        Executes an instance of the processing class and returns a list.
+        Executes an instance of the processing class and returns a list,
+        served from the region's prefetch buffer if it has a
+        `prefetch_size` processing parameter.  Set the region's
+        `consumption_archive` processing parameter to true to record the
+        issued numbers in its archive; the archive's log is flushed in the
+        background.
         '''
-        processing_class = import_processing_class(region)
-        return self.set_number_list(response, processing_class().get_items(region, size))
+        processing_instance = import_processing_class(region)()
+        prefetch_size = prefetch.get_prefetch_size(region)
+        if prefetch_size:
+            numbers = prefetch.get_items(region, processing_instance, size,
+                                         prefetch_size)
+        else:
+            numbers = processing_instance.get_items(region, size)
+        if region.get_processing_parameter(
+                'consumption_archive', 'false').lower() == 'true':
+            if archive.record(region.archive_file_path, uuid.uuid1().hex,
+                              region.machine_name, time.time(), numbers):
+                replenishment.run_in_background(
+                    ('archive', region.pk), archive.flush,
+                    region.archive_file_path)
+        return self.set_number_list(response, numbers)
 
     def get_settings_module(self):
         return settings
 
+    def _get_pool(self, request, pool):
+        '''
+        Same as the SerialBox implementation except that the pool's
+        allocation strategy is loaded along with it.
+        '''
+        try:
+            kwargs = {"pk": pool} if isinstance(pool, int) else \
+                {"machine_name": pool}
+            return Pool.objects.select_related('list_based_strategy').get(
+                active=True, **kwargs)
+        except Pool.DoesNotExist:
+            raise errors.PoolNotFoundException
+
+    def _get_region(self, pool_instance, region_id):
+        '''
+        Returns the pool's active list-based region with the machine name.
+        '''
+        try:
+            return ListBasedRegion.objects.select_related('pool').get(
+                pool=pool_instance, machine_name=region_id, active=True)
+        except ListBasedRegion.DoesNotExist:
+            raise NotFound(
+                "SerialBox could not find an active list-based region with "
+                "the machine name %s in the pool %s." % (
+                    region_id, pool_instance.machine_name))
+
+    def _execute_post_processing_rules(self, request, response,
+                                       size, pool, region):
+        '''
+        Runs the post-processing rules of the region's processing class
+        only.  The numbers have already been issued by now, so the limit
+        rules configured for the generator are not run and a failing rule
+        is logged rather than failing the request.
+        '''
+        try:
+            ListBasedPostprocessRule().execute(request, pool, region, size)
+        except Exception:
+            logger.exception('A post-processing rule of region %s failed.',
+                             region)
+
 
 
 class ListBasedPreprocessRule(PreprocessingRule):
@@ -39,3 +39,65 @@ GENERATOR_POSTPROCESSING_RULES = getattr(
             'list_based_flavorpack.generators.list_based.ListBasedPostprocessRule',
             'serialbox.rules.limits.RequestThresholdLimitRule',
         ]})
+
+# The maximum number of region database connections each thread keeps
+# open.  The least recently used connection is closed past this limit.
+SQLITE_MAX_CONNECTIONS = getattr(
+    settings,
+    'LIST_BASED_SQLITE_MAX_CONNECTIONS',
+    16)
+
+# PRAGMA statements applied once to every region database connection.
+# auto_vacuum only applies to databases created with it; existing ones
+# are switched over by a full vacuum (see the vacuum_db_region command).
+SQLITE_PRAGMAS = getattr(
+    settings,
+    'LIST_BASED_SQLITE_PRAGMAS',
+    {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'busy_timeout': 30000,
+    })
+
+# Named tuning profiles a DB region can select with its `sqlite_profile`
+# processing parameter.  Each maps pragma names to values that override
+# SQLITE_PRAGMAS for that region's connections.
+SQLITE_PROFILES = getattr(
+    settings,
+    'LIST_BASED_SQLITE_PROFILES',
+    {
+        'throughput': {
+            'synchronous': 'NORMAL',
+            'cache_size': -65536,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+        },
+        'durable': {
+            'synchronous': 'FULL',
+        },
+        'rollback': {
+            'journal_mode': 'DELETE',
+            'synchronous': 'FULL',
+        },
+    })
+
+# The number of threads each process uses to replenish regions that
+# have dropped below their low watermark and to compact regions.
+REPLENISHMENT_WORKERS = getattr(
+    settings,
+    'LIST_BASED_REPLENISHMENT_WORKERS',
+    4)
+
+# How many seconds an allocation waits for another request's
+# replenishment of the same region before giving up.
+REPLENISHMENT_TIMEOUT = getattr(
+    settings,
+    'LIST_BASED_REPLENISHMENT_TIMEOUT',
+    120)
+
+# The number of threads each process uses to serve the regions of a
+# batch allocation concurrently.  Set to 1 to serve them one at a time.
+BATCH_ALLOCATION_WORKERS = getattr(
+    settings,
+    'LIST_BASED_BATCH_ALLOCATION_WORKERS',
+    8)
@@ -0,0 +1,38 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.utils import compact_list_based_region
+
+
+class Command(BaseCommand):
+    help = _('Removes the consumed lines from a flat-file list-based '
+             'region by machine name')
+
+    def add_arguments(self, parser):
+        parser.add_argument('machine_name', type=str,
+                            help='The machine name of the region to compact')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Discard the consumed lines instead of '
+                                 'archiving them')
+
+    def handle(self, *args, **options):
+        region = ListBasedRegion.objects.get(
+            machine_name=options['machine_name'])
+        removed = compact_list_based_region(region,
+                                            not options['no_archive'])
+        print(_('Removed %s consumed lines from region %s') %
+              (removed, region.machine_name))
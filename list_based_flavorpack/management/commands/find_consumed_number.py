@@ -0,0 +1,46 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.storage import archive
+
+
+class Command(BaseCommand):
+    help = _('Looks up which allocation issued a number in the consumption '
+             'archive of a list-based region')
+
+    def add_arguments(self, parser):
+        parser.add_argument('machine_name', type=str,
+                            help='The machine name of the region')
+        parser.add_argument('serial_number', type=str,
+                            help='The number to look up')
+
+    def handle(self, *args, **options):
+        region = ListBasedRegion.objects.get(
+            machine_name=options['machine_name'])
+        allocation = archive.find_allocation(region.archive_file_path,
+                                             options['serial_number'])
+        if allocation:
+            print(_('%s was issued by allocation %s of %s numbers from '
+                    'region %s at %s') % (
+                options['serial_number'], allocation['allocation_id'],
+                allocation['size'], allocation['region'],
+                datetime.fromtimestamp(allocation['issued']).isoformat()))
+        else:
+            print(_('%s is not in the consumption archive of region %s') %
+                  (options['serial_number'], region.machine_name))
@@ -0,0 +1,40 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.processing_classes.third_party_processing.rules import \
+    get_region_table
+from list_based_flavorpack.storage import sqlite
+
+
+class Command(BaseCommand):
+    help = _('Adds the unused-number index and inventory counter to the '
+             'databases of existing DB list-based regions by machine name')
+
+    def add_arguments(self, parser):
+        parser.add_argument('machine_names', type=str, nargs='+',
+                            help='The machine names of the regions to '
+                                 'upgrade')
+
+    def handle(self, *args, **options):
+        for machine_name in options['machine_names']:
+            region = ListBasedRegion.objects.get(machine_name=machine_name)
+            for path in sqlite.get_shard_paths(region):
+                sqlite.create_region_table(
+                    sqlite.get_region_connection(region, path),
+                    get_region_table(region))
+            print(_('Upgraded the database of region %s') %
+                  region.machine_name)
@@ -0,0 +1,45 @@
+# This program is free software: you can redistribute it and/| modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, |
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY | FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2021 SerialLab Corp.  All rights reserved.
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.utils import vacuum_db_region
+
+
+class Command(BaseCommand):
+    help = _('Reclaims the free pages of DB list-based region databases '
+             'by machine name')
+
+    def add_arguments(self, parser):
+        parser.add_argument('machine_names', type=str, nargs='+',
+                            help='The machine names of the regions to '
+                                 'vacuum')
+        parser.add_argument('--max-pages', type=int, default=None,
+                            help='The most free pages to reclaim from each '
+                                 'region. Default is all of them')
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild each database with VACUUM INTO, '
+                                 'blocking allocations meanwhile')
+
+    def handle(self, *args, **options):
+        for machine_name in options['machine_names']:
+            region = ListBasedRegion.objects.get(machine_name=machine_name)
+            metrics = vacuum_db_region(region, options['max_pages'],
+                                       options['full'])
+            print(_('Reclaimed %s pages from region %s in %.3f seconds; '
+                    '%s pages with %s free remain') % (
+                metrics['reclaimed_pages'], region.machine_name,
+                metrics['seconds'], metrics['page_count'],
+                metrics['free_pages']))
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('list_based_flavorpack', '0010_auto_20210302_1041'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListBasedNumber',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('sequence', models.BigIntegerField(help_text='The order in which the number was received and will be issued.', verbose_name='Sequence')),
+                ('serial_number', models.CharField(help_text='The number.', max_length=100, verbose_name='Serial Number')),
+                ('list_based_region', models.ForeignKey(help_text='The region the number belongs to.', on_delete=django.db.models.deletion.CASCADE, related_name='numbers', to='list_based_flavorpack.listbasedregion', verbose_name='Region')),
+            ],
+            options={
+                'verbose_name': 'List-Based Number',
+                'verbose_name_plural': 'List-Based Numbers',
+                'unique_together': {('list_based_region', 'sequence')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serialbox', '0001_initial'),
+        ('list_based_flavorpack', '0011_listbasednumber'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoolAllocationStrategy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strategy', models.CharField(choices=[('first', 'First region by order'), ('round_robin', 'Round robin'), ('most_inventory', 'Most inventory first'), ('failover', 'Failover on insufficient inventory')], default='first', help_text='How the region serving a request is chosen.  Regions that can fill a request from their inventory are always chosen over regions that would have to be replenished first.', max_length=20, verbose_name='Strategy')),
+                ('pool', models.OneToOneField(help_text='The pool the strategy applies to.', on_delete=django.db.models.deletion.CASCADE, related_name='list_based_strategy', to='serialbox.pool', verbose_name='Pool')),
+            ],
+            options={
+                'verbose_name': 'Pool Allocation Strategy',
+                'verbose_name_plural': 'Pool Allocation Strategies',
+            },
+        ),
+    ]
@@ -151,6 +151,55 @@ class ListBasedRegion(sb_models.Region):
         return os.path.join(self.directory_path, '%s.%s' %
                             (self.database_name, 'db'))
 
+    @property
+    def lock_file_path(self):
+        '''
+        The lock file used to coordinate allocation, ingest and
+        maintenance of the region's storage across processes.
+        '''
+        return os.path.join(self.directory_path, '%s.%s' %
+                            (self.database_name, 'lock'))
+
+    @property
+    def archive_file_path(self):
+        '''
+        The SQLite database recording the numbers the region has issued,
+        if its consumption archive is enabled.
+        '''
+        return os.path.join(self.directory_path, '%s.%s' %
+                            (self.database_name, 'archive.db'))
+
+    def _get_processing_parameters(self):
+        params = self.__dict__.get('_processing_parameters')
+        if params is None:
+            params = {}
+            # all() so that prefetch_related('processing_parameters') is
+            # used.  Keys are not unique; the last parameter wins.
+            for param in sorted(self.processing_parameters.all(),
+                                key=lambda param: param.pk):
+                params[param.key] = param.value
+            self._processing_parameters = params
+        return params
+
+    def get_processing_parameter(self, key, default=None):
+        '''
+        Returns the value of one of the region's processing parameters
+        or the default if the region does not define it.  The parameters
+        are loaded once per instance; a full refresh_from_db reloads them.
+        '''
+        return self._get_processing_parameters().get(key, default)
+
+    def get_processing_parameters(self):
+        '''
+        Returns all of the region's processing parameters as a dictionary.
+        '''
+        return dict(self._get_processing_parameters())
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        if fields is None:
+            self.__dict__.pop('_processing_parameters', None)
+        super().refresh_from_db(using, fields, **kwargs)
+
     class Meta:
         verbose_name = _('List-Based Region')
         verbose_name_plural = _('List-Based Regions')
@@ -179,3 +228,74 @@ class ProcessingParameters(models.Model):
 
     def __str__(self):
         return "{\"%s\": \"%s\"}" % (self.key, self.value)
+
+
+class ListBasedNumber(models.Model):
+    '''
+    A number held in a region's inventory by the ORMProcessingClass.
+    Numbers are issued in sequence order and removed once issued.
+    '''
+    id = models.BigAutoField(primary_key=True)
+    list_based_region = models.ForeignKey(ListBasedRegion,
+                                          on_delete=models.CASCADE,
+                                          related_name="numbers",
+                                          verbose_name=_("Region"),
+                                          help_text=_(
+                                              "The region the number "
+                                              "belongs to."))
+    sequence = models.BigIntegerField(
+        verbose_name=_("Sequence"),
+        help_text=_("The order in which the number was received and will "
+                    "be issued."))
+    serial_number = models.CharField(
+        max_length=100,
+        verbose_name=_("Serial Number"),
+        help_text=_("The number."))
+
+    def __str__(self):
+        return self.serial_number
+
+    class Meta:
+        verbose_name = _('List-Based Number')
+        verbose_name_plural = _('List-Based Numbers')
+        unique_together = ('list_based_region', 'sequence')
+
+
+class PoolAllocationStrategy(models.Model):
+    '''
+    How requests to a pool that don't name a region choose among the
+    pool's list-based regions.  Pools without a strategy allocate from
+    their first active region.
+    '''
+    FIRST = 'first'
+    ROUND_ROBIN = 'round_robin'
+    MOST_INVENTORY = 'most_inventory'
+    FAILOVER = 'failover'
+    STRATEGY_CHOICES = (
+        (FIRST, _('First region by order')),
+        (ROUND_ROBIN, _('Round robin')),
+        (MOST_INVENTORY, _('Most inventory first')),
+        (FAILOVER, _('Failover on insufficient inventory')),
+    )
+    pool = models.OneToOneField(sb_models.Pool,
+                                on_delete=models.CASCADE,
+                                related_name="list_based_strategy",
+                                verbose_name=_("Pool"),
+                                help_text=_("The pool the strategy applies "
+                                            "to."))
+    strategy = models.CharField(
+        max_length=20,
+        choices=STRATEGY_CHOICES,
+        default=FIRST,
+        verbose_name=_("Strategy"),
+        help_text=_("How the region serving a request is chosen.  Regions "
+                    "that can fill a request from their inventory are "
+                    "always chosen over regions that would have to be "
+                    "replenished first."))
+
+    def __str__(self):
+        return "%s: %s" % (self.pool, self.strategy)
+
+    class Meta:
+        verbose_name = _('Pool Allocation Strategy')
+        verbose_name_plural = _('Pool Allocation Strategies')
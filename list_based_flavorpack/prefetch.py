@@ -0,0 +1,152 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+
+    Per-process buffers of numbers already claimed from a region's
+    storage.  A region with a `prefetch_size` processing parameter claims
+    that many numbers at once and serves later requests from memory.
+    Claims are committed by the processing class before any number is
+    buffered, so a number can never be issued twice; at worst the
+    numbers buffered when a process dies are lost.
+'''
+import atexit
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# What to do with unissued numbers when a buffer is released, chosen by
+# the region's `prefetch_shutdown` processing parameter.  Returning them
+# requires the processing class to implement return_items(region,
+# numbers); otherwise they are written off.
+SHUTDOWN_POLICIES = ('write_off', 'return')
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+class _Buffer:
+
+    def __init__(self):
+        self.numbers = deque()
+        self.lock = threading.Lock()
+        self.region = None
+        self.processing_instance = None
+        self.policy = 'write_off'
+
+
+def get_prefetch_size(region):
+    '''
+    Returns the region's `prefetch_size` processing parameter, 0 if it
+    does not prefetch.
+    '''
+    return int(region.get_processing_parameter('prefetch_size', 0))
+
+
+def get_buffered_count(region):
+    '''
+    Returns the number of claimed but unissued numbers this process holds
+    for a region.
+    '''
+    buffer = _buffers.get(region.pk)
+    return len(buffer.numbers) if buffer else 0
+
+
+def _get_buffer(region):
+    with _buffers_lock:
+        return _buffers.setdefault(region.pk, _Buffer())
+
+
+def _get_available_count(region, processing_instance):
+    for rule in processing_instance.get_pre_processing_rules():
+        if hasattr(rule, 'get_available_count'):
+            return rule().get_available_count(region)
+    return 0
+
+
+def get_items(region, processing_instance, size, prefetch_size):
+    '''
+    Serves `size` numbers from the region's buffer, first claiming a
+    block of up to `prefetch_size` numbers (never less than is missing)
+    from storage through the processing instance if the buffer is short.
+    '''
+    buffer = _get_buffer(region)
+    with buffer.lock:
+        missing = size - len(buffer.numbers)
+        if missing > 0:
+            block = missing
+            if prefetch_size > missing:
+                block = max(missing, min(
+                    prefetch_size,
+                    _get_available_count(region, processing_instance)))
+            policy = region.get_processing_parameter('prefetch_shutdown',
+                                                     'write_off')
+            if policy not in SHUTDOWN_POLICIES:
+                raise ValueError('Unknown prefetch shutdown policy %s; '
+                                 'expected write_off or return.' % policy)
+            buffer.numbers.extend(
+                processing_instance.get_items(region, block))
+            buffer.region = region
+            buffer.processing_instance = processing_instance
+            buffer.policy = policy
+            if len(buffer.numbers) < size:
+                raise ValueError("There are not enough numbers to satisfy "
+                                 "the request.")
+        return [buffer.numbers.popleft() for i in range(size)]
+
+
+def release(region):
+    '''
+    Empties a region's buffer, returning the unissued numbers to storage
+    or writing them off according to the region's shutdown policy.
+    Returns the number of numbers returned.
+    '''
+    with _buffers_lock:
+        buffer = _buffers.pop(region.pk, None)
+    if not buffer:
+        return 0
+    with buffer.lock:
+        numbers = list(buffer.numbers)
+        buffer.numbers.clear()
+        if not numbers:
+            return 0
+        return_items = getattr(buffer.processing_instance, 'return_items',
+                               None)
+        if buffer.policy == 'return' and return_items:
+            return_items(buffer.region, numbers)
+            return len(numbers)
+        logger.warning('Writing off %s unissued numbers prefetched for '
+                       'region %s.', len(numbers),
+                       buffer.region.machine_name)
+        return 0
+
+
+@atexit.register
+def release_all():
+    '''
+    Releases every buffer this process holds.  Runs at shutdown.
+    '''
+    for buffer in list(_buffers.values()):
+        if buffer.region is None:
+            # its first claim failed, so it holds no numbers.
+            continue
+        try:
+            release(buffer.region)
+        except Exception:
+            logger.exception('Could not release the numbers prefetched for '
+                             'region %s.', buffer.region.machine_name)
@@ -1,9 +1,13 @@
-import os
-import linecache
-import sqlite3
+import random
+from django.db import transaction
+from django.db.models import Min
 from list_based_flavorpack.processing_classes.third_party_processing import \
     rules
-from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack import cursor
+from list_based_flavorpack.models import ListBasedRegion, ListBasedNumber
+from list_based_flavorpack.storage import index, mapping, fixed_width, \
+    segments, blocks, sqlite
+from list_based_flavorpack.storage.locks import lock_file, try_lock_file
 from list_based_flavorpack.processing_classes.third_party_processing.rules import \
     get_region_table
 
@@ -20,7 +24,7 @@ class ThirdPartyProcessingClass:
         '''
         self.pre_processing_rules = [rules.ValidNumberDirectory,
                                      rules.SufficientNumbersStorage]
-        self.post_processing_rules = []
+        self.post_processing_rules = [rules.CompactConsumedNumbers]
 
     def get_pre_processing_rules(self):
         '''
@@ -37,22 +41,150 @@ class ThirdPartyProcessingClass:
     def get_items(self, region, size):
         '''
         Pull numbers from the file created/updated from rules previously executed.
+        The region's lines are reserved before they are read by advancing
+        its cursor in a single atomic update, so concurrent workers always
+        get disjoint ranges.  The update only succeeds if the file holds
+        every reserved line, so the cursor never passes the end of the
+        file.  If the read still fails the reservation is undone unless
+        another allocation has reserved lines since.  The region's lock
+        is held shared so that compaction can not swap the file out from
+        under the read.  If the region's cursor_mode processing parameter
+        is journal the reservation is journaled before the lines are read.
+        '''
+        with lock_file(region.lock_file_path, shared=True):
+            region.refresh_from_db(fields=['file_id'])
+            limit = self.get_line_count(region) + 1
+            if cursor.uses_journal(region):
+                first = cursor.reserve(region, size, limit)
+            else:
+                max_line = cursor.advance_cursor(region, size, limit)
+                first = None if max_line is None else max_line - size
+            if first is None:
+                raise rules.InsufficientNumbersError(
+                    "There are not enough numbers to satisfy the request.")
+            region.last_number_line = first + size
+            try:
+                return self.read_lines(region, first, size)
+            except Exception:
+                cursor.release(region, first, size)
+                raise
+
+    def get_line_count(self, region):
+        '''
+        Returns the number of lines in the region's file.  Override along
+        with `read_lines` to support other file formats.
+        '''
+        return index.sync_index(region.file_path)
+
+    def read_lines(self, region, first, size):
+        '''
+        Reads `size` numbers starting at line number `first`.  The offset
+        index kept next to the file is used to seek straight to them.
+        Override to support other file formats.
+        '''
+        return index.read_lines(region.file_path, first, size)
+
+
+class MMapProcessingClass(ThirdPartyProcessingClass):
+    '''
+    Reads numbers out of a memory map of the region's file that is reused
+    across requests in the same worker.  Well suited to large allocations
+    since each block is decoded directly from the mapped pages.
+    '''
+
+    def read_lines(self, region, first, size):
+        return mapping.read_lines(region.file_path, first, size)
+
+
+class FixedWidthProcessingClass(ThirdPartyProcessingClass):
+    '''
+    Uses a file of fixed-width records (see
+    `list_based_flavorpack.storage.fixed_width`) so the position of any
+    number can be computed from its line number.  Use with the
+    FixedWidthUUIDRequestStep or another step that writes the format.
+    '''
+
+    def __init__(self):
+        '''
+        Sets processing rules.
+        '''
+        self.pre_processing_rules = [rules.ValidNumberDirectory,
+                                     rules.SufficientFixedWidthNumbers]
+        self.post_processing_rules = []
+
+    def get_line_count(self, region):
+        return fixed_width.get_record_count(region.file_path)
+
+    def read_lines(self, region, first, size):
+        return fixed_width.read_records(region.file_path, first, size)
+
+
+class CompressedProcessingClass(ThirdPartyProcessingClass):
+    '''
+    Reads numbers from a file of independently compressed blocks (see
+    `list_based_flavorpack.storage.blocks`), decompressing only the blocks
+    that cover each allocation.  Use with the CompressedUUIDRequestStep or
+    convert an existing region with the convert_list_based_region command.
+    '''
+
+    def __init__(self):
+        '''
+        Sets processing rules.
+        '''
+        self.pre_processing_rules = [rules.ValidNumberDirectory,
+                                     rules.SufficientCompressedNumbers]
+        self.post_processing_rules = []
+
+    def get_line_count(self, region):
+        return blocks.get_line_count(region.file_path)
+
+    def read_lines(self, region, first, size):
+        return blocks.read_lines(region.file_path, first, size)
+
+
+class SegmentedProcessingClass(ThirdPartyProcessingClass):
+    '''
+    Stores numbers in fixed-size segment files listed in a manifest kept
+    at the region's file path (see
+    `list_based_flavorpack.storage.segments`).  Allocations only open the
+    segments they need and fully consumed segments are deleted.  Use with
+    the SegmentedUUIDRequestStep or another step that writes segments.
+    '''
+
+    def __init__(self):
+        '''
+        Sets processing rules.
+        '''
+        self.pre_processing_rules = [rules.ValidNumberDirectory,
+                                     rules.SufficientSegmentedNumbers]
+        self.post_processing_rules = []
+
+    def get_items(self, region, size):
+        '''
+        Reserves and reads the lines like any other flat-file region,
+        honoring its cursor_mode, and then deletes the segments that have
+        been fully consumed if no other request holds the region's lock.
         '''
-        first = region.last_number_line
-        max_line = first + size
-        lines = []
-        linecache.checkcache(filename=region.file_path)
-        for lineno in range(first, max_line):
-            item = linecache.getline(region.file_path, lineno).strip()
-            if not item:
-                raise ValueError(
-                    "There are not enough numbers available for this iteration starting on line number: %s",
-                    lineno)
-            lines.append(item)
-        region.last_number_line = max_line
-        region.save()
+        lines = super().get_items(region, size)
+        # segments are only deleted while no reservation is being read.
+        with try_lock_file(region.lock_file_path) as acquired:
+            if acquired:
+                region.refresh_from_db(fields=['file_id',
+                                               'last_number_line'])
+                segments.release_consumed(
+                    region.file_path,
+                    segments.read_manifest(region.file_path),
+                    region.last_number_line)
         return lines
 
+    def get_line_count(self, region):
+        return segments.read_manifest(region.file_path)['next_line'] - 1
+
+    def read_lines(self, region, first, size):
+        return segments.read_lines(region.file_path,
+                                   segments.read_manifest(region.file_path),
+                                   first, size)
+
 
 class DBProcessingClass(ThirdPartyProcessingClass):
     '''
@@ -66,23 +198,222 @@ class DBProcessingClass(ThirdPartyProcessingClass):
         '''
         self.pre_processing_rules = [rules.ValidNumberDirectory,
                                      rules.SufficientDBNumbers]
+        self.post_processing_rules = [rules.ReclaimFreePages]
+
+    claim_statements = {
+        'delete': 'DELETE FROM %s WHERE used = 0 AND rowid BETWEEN ? AND ?',
+        'mark': 'UPDATE %s SET used = 1 WHERE used = 0 '
+                'AND rowid BETWEEN ? AND ?',
+    }
+
+    def get_claim_mode(self, region):
+        claim_mode = region.get_processing_parameter('claim_mode', 'delete')
+        if claim_mode not in self.claim_statements:
+            raise ValueError('Unknown claim mode %s; expected delete or '
+                             'mark.' % claim_mode)
+        return claim_mode
+
+    def select_rows(self, connection, table, size):
+        '''
+        Returns up to `size` of the oldest unused rows as (rowid,
+        serial_number) tuples.
+        '''
+        return connection.execute(
+            "SELECT rowid, serial_number FROM %s WHERE used = 0 "
+            "ORDER BY rowid LIMIT ?" % table,
+            (size,)
+        ).fetchall()
+
+    def claim_rows(self, connection, table, rows, claim_mode):
+        '''
+        Claims rows returned by `select_rows` within the connection's open
+        transaction with a single ranged statement.
+        '''
+        if rows:
+            connection.execute(self.claim_statements[claim_mode] % table,
+                               (rows[0][0], rows[-1][0]))
+
+    def get_items(self, region: ListBasedRegion, size):
+        '''
+        Claims the `size` oldest numbers as one contiguous rowid range:
+        a single select followed by a single ranged delete inside an
+        immediate transaction.  The delete only runs once the select has
+        found enough rows to satisfy the whole request.  With the region's `claim_mode`
+        processing parameter set to mark, claimed numbers are kept and
+        flagged as used instead.
+        '''
+        claim_mode = self.get_claim_mode(region)
+        connection = sqlite.get_region_connection(region)
+        table = get_region_table(region)
+        # a full vacuum holds the region lock exclusively.
+        with lock_file(region.lock_file_path, shared=True):
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.select_rows(connection, table, size)
+                if len(rows) < size:
+                    raise rules.InsufficientNumbersError(
+                        "There are not enough numbers to satisfy the "
+                        "request.")
+                self.claim_rows(connection, table, rows, claim_mode)
+                connection.commit()
+            except:
+                connection.rollback()
+                raise
+        return [row[1] for row in rows]
+
+    def return_items(self, region: ListBasedRegion, numbers):
+        '''
+        Puts claimed but unissued numbers back into the region's (first)
+        database as unused rows.
+        '''
+        connection = sqlite.get_region_connection(
+            region, sqlite.get_shard_paths(region)[0])
+        with lock_file(region.lock_file_path, shared=True):
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO %s (serial_number, used) '
+                    'VALUES (?, 0)' % get_region_table(region),
+                    ((number,) for number in numbers))
+
+
+class ShardedDBProcessingClass(DBProcessingClass):
+    '''
+    Spreads a region's numbers across the `shard_count` (a processing
+    parameter) SQLite databases returned by `sqlite.get_shard_paths` so
+    that concurrent allocations don't all queue on one writer lock.
+    '''
+
+    def __init__(self):
+        '''
+        Sets processing rules.
+        '''
+        self.pre_processing_rules = [rules.ValidNumberDirectory,
+                                     rules.SufficientShardedDBNumbers]
+        self.post_processing_rules = [rules.ReclaimFreePages]
+
+    def get_items(self, region: ListBasedRegion, size):
+        '''
+        Claims numbers shard by shard, starting from a random shard and
+        skipping any whose writer lock is held, until the request is
+        filled.  If the shards that were free can't fill it, everything
+        is rolled back and the claim is retried waiting on each shard in
+        order.  Nothing is claimed on any shard until the rows selected
+        across the shards satisfy the whole request, and the claims are
+        committed together.
+        '''
+        claim_mode = self.get_claim_mode(region)
+        table = get_region_table(region)
+        paths = sqlite.get_shard_paths(region)
+        start = random.randrange(len(paths))
+        with lock_file(region.lock_file_path, shared=True):
+            numbers = self._claim(region, table, size, claim_mode,
+                                  paths[start:] + paths[:start], False)
+            if numbers is None:
+                numbers = self._claim(region, table, size, claim_mode,
+                                      paths, True)
+        if numbers is None:
+            raise rules.InsufficientNumbersError(
+                "There are not enough numbers to satisfy the request.")
+        return numbers
+
+    def _claim(self, region, table, size, claim_mode, paths, wait):
+        # the shards' rows are all selected before any is claimed, so a
+        # short request never runs a claim statement.
+        connections = []
+        selected = []
+        count = 0
+        try:
+            for path in paths:
+                if count == size:
+                    break
+                connection = sqlite.get_region_connection(region, path)
+                if not sqlite.begin_immediate(connection, wait):
+                    continue
+                connections.append(connection)
+                selected.append(self.select_rows(connection, table,
+                                                 size - count))
+                count += len(selected[-1])
+            if count < size:
+                for connection in connections:
+                    connection.rollback()
+                return None
+            for connection, rows in zip(connections, selected):
+                self.claim_rows(connection, table, rows, claim_mode)
+        except:
+            for connection in connections:
+                connection.rollback()
+            raise
+        for connection in connections:
+            connection.commit()
+        return [row[1] for rows in selected for row in rows]
+
+
+class ORMProcessingClass(ThirdPartyProcessingClass):
+    '''
+    Keeps a region's numbers in the ListBasedNumber table of the main
+    database so that every app node sharing that database can allocate
+    from the region.
+    '''
+
+    # The most numbers deleted per statement, kept under SQLite's limit
+    # on query parameters.
+    delete_batch_size = 900
+
+    def __init__(self):
+        '''
+        Sets processing rules.
+        '''
+        self.pre_processing_rules = [rules.SufficientORMNumbers]
         self.post_processing_rules = []
 
     def get_items(self, region: ListBasedRegion, size):
-        connection = sqlite3.connect(region.db_file_path)
-        cursor = connection.cursor()
-        cursor.execute(
-            "SELECT serial_number FROM %s WHERE used = 0 LIMIT ?" % get_region_table(region),
-            (size,)
-        )
-        rows = cursor.fetchall()
-        lines = []
-        for row in rows:
-            lines.append(row[0])
-            cursor.execute('DELETE FROM %s WHERE serial_number = ?'
-                           % get_region_table(region), (row[0],))
-        connection.commit()
-        if len(rows) < size:
-            raise ValueError("There are not enough numbers to satisfy the "
-                             "request.")
-        return lines
+        '''
+        Locks and deletes the `size` lowest-sequence numbers that no
+        other transaction has locked.  Rows locked by concurrent
+        allocations are skipped rather than waited on, so workers never
+        block each other or issue the same number twice.  If that leaves
+        the request short the rows are selected again, this time waiting
+        on the locked ones, since a concurrent allocation that rolls back
+        releases its rows.  Nothing is deleted unless the whole request
+        can be satisfied.
+        '''
+        with transaction.atomic():
+            rows = self.select_rows(region, size, skip_locked=True)
+            if len(rows) < size:
+                rows = self.select_rows(region, size, skip_locked=False)
+            if len(rows) < size:
+                raise rules.InsufficientNumbersError(
+                    "There are not enough numbers to satisfy the request.")
+            for i in range(0, len(rows), self.delete_batch_size):
+                ListBasedNumber.objects.filter(id__in=[
+                    row[0] for row in rows[i:i + self.delete_batch_size]
+                ]).delete()
+        return [row[1] for row in rows]
+
+    def select_rows(self, region, size, skip_locked):
+        '''
+        Locks and returns the region's `size` lowest-sequence numbers as
+        (id, serial_number) tuples.
+        '''
+        return list(ListBasedNumber.objects.select_for_update(
+            skip_locked=skip_locked).filter(list_based_region=region).order_by(
+            'sequence').values_list('id', 'serial_number')[:size])
+
+    def return_items(self, region: ListBasedRegion, numbers):
+        '''
+        Puts claimed but unissued numbers back at the front of the
+        region's inventory.
+        '''
+        with transaction.atomic():
+            ListBasedRegion.objects.select_for_update().only('pk').get(
+                pk=region.pk)
+            first = ListBasedNumber.objects.filter(
+                list_based_region=region).aggregate(
+                Min('sequence'))['sequence__min']
+            if first is None:
+                first = 1
+            ListBasedNumber.objects.bulk_create(
+                [ListBasedNumber(list_based_region=region,
+                                 sequence=first - len(numbers) + i,
+                                 serial_number=number)
+                 for i, number in enumerate(numbers)])
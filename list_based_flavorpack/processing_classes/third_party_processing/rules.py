@@ -17,18 +17,31 @@
     along with RandomFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import struct
 import uuid
-import sqlite3
 from random import randint
 from datetime import date, time, datetime
-from serialbox.rules.common import PreprocessingRule
+from serialbox.rules.common import PreprocessingRule, PostprocessingRule
 from serialbox.rules.errors import RuleError
 from quartet_capture.tasks import create_and_queue_task
 from quartet_capture.models import TaskParameter
+from list_based_flavorpack.storage import index, fixed_width, segments, \
+    blocks, sqlite, vacuum
+from list_based_flavorpack.storage.locks import lock_file
+from list_based_flavorpack import prefetch, replenishment
+from list_based_flavorpack.models import ListBasedRegion, ListBasedNumber
+from list_based_flavorpack.utils import compact_list_based_region
 
 def get_region_table(region):
     return "REGION_{0}".format(region.database_name)
 
+class InsufficientNumbersError(ValueError):
+    '''
+    Raised by a processing class that can't fill a request from a
+    region's inventory.  No numbers have been issued when it is raised.
+    '''
+
+
 class ValidDirectoryError(RuleError):
 
     def __init__(self, detail=None, directory_path=""):
@@ -41,6 +54,8 @@ class ValidDirectoryError(RuleError):
 class ValidNumberDirectory(PreprocessingRule):
     '''
     Checks if the number directory exists and attempts to create it if applicable.
+    The region is refreshed under its shared lock first so that a file
+    swapped out by compaction is never recreated.
     '''
 
     def execute(self, request, pool, region, size):
@@ -48,9 +63,11 @@ class ValidNumberDirectory(PreprocessingRule):
         try:
             if not os.path.exists(region.directory_path):
                 os.makedirs(region.directory_path)
-            if not os.path.exists(region.file_path):
-                with open(region.file_path, 'a'):
-                    os.utime(region.file_path, None)
+            with lock_file(region.lock_file_path, shared=True):
+                region.refresh_from_db(fields=['file_id', 'last_number_line'])
+                if not os.path.exists(region.file_path):
+                    with open(region.file_path, 'a'):
+                        os.utime(region.file_path, None)
         except:
             raise ValidDirectoryError(directory_path=region.file_path)
 
@@ -71,8 +88,7 @@ class SufficientNumbersStorage(PreprocessingRule):
         template = region.template
         task_param = TaskParameter(name="List-based Region",
                                    value=region.machine_name)
-        processing_params_dict = {item.key: item.value for item in
-                                  region.processing_parameters.all()}
+        processing_params_dict = region.get_processing_parameters()
 
         processing_params_dict[
             "authentication_info"] = region.authentication_info
@@ -103,48 +119,157 @@ class SufficientNumbersStorage(PreprocessingRule):
             raise RuleError(
                 detail="An error occurred while attempting to request new numbers from third-party system. Please check the log output from task %s" % task.name)
 
-    def execute(self, request, pool, region, size):
+    def get_available_count(self, region):
+        '''
+        Returns the number of unissued numbers in the region's storage.
+        The line count is read from the offset index kept by the ingest
+        steps, so the number file itself is never scanned.  The region's
+        file and cursor are refreshed under its shared lock so a
+        concurrent compaction can't be miscounted.
+        '''
         try:
-            file_size = sum((1 for i in open(region.file_path)))
-        except OSError as e:
+            with lock_file(region.lock_file_path, shared=True):
+                region.refresh_from_db(fields=['file_id', 'last_number_line'])
+                line_count = index.sync_index(region.file_path)
+        except OSError:
             raise RuleError(
                 detail="An error occurred while opening attempting to "
                        "read the file to store numbers: %s" % region.file_path)
-        if region.last_number_line + size >= file_size:
-            currently_available = (
-                                              file_size + 1) - region.last_number_line  # don't overfetch if not needed.
+        return line_count - region.last_number_line + 1
+
+    def replenish(self, request, pool, region, size):
+        '''
+        Fetches the numbers missing for the request unless another
+        request is already replenishing the region, in which case it
+        waits for that replenishment and uses its numbers.
+        '''
+        timeout = replenishment.get_timeout(region)
+        with replenishment.single_flight(region, timeout) as acquired:
+            region.refresh_from_db()
+            currently_available = self.get_available_count(
+                region) + prefetch.get_buffered_count(region)
+            if size <= currently_available:
+                return
+            if not acquired:
+                raise RuleError(
+                    detail="Timed out after %s seconds waiting for another "
+                           "request to replenish region %s." % (
+                               timeout, region.machine_name))
+            # don't overfetch if not needed.
             self.fetch_more_numbers(request, pool, region,
                                     size - currently_available)
-        else:
-            # numbers are sufficient. Nothing to do.
-            pass
+
+    def execute(self, request, pool, region, size):
+        '''
+        Fetches the numbers missing for the request before it is served.
+        If the region has a `low_watermark` processing parameter and the
+        request leaves fewer numbers than that, a replenishment is also
+        started in the background so that later requests don't have to
+        wait for one.
+        '''
+        buffered = prefetch.get_buffered_count(region)
+        if size <= buffered:
+            # the request will be served from the prefetch buffer.
+            return
+        currently_available = self.get_available_count(region) + buffered
+        if size > currently_available:
+            self.replenish(request, pool, region, size)
+        elif currently_available - size < \
+                replenishment.get_low_watermark(region):
+            replenishment.replenish_async(self, region)
+
+
+class SufficientFixedWidthNumbers(SufficientNumbersStorage):
+    '''
+    Computes the available numbers from the size of a fixed-width file.
+    '''
+
+    def get_available_count(self, region):
+        try:
+            record_count = fixed_width.get_record_count(region.file_path)
+        except OSError:
+            raise RuleError(
+                detail="An error occurred while opening attempting to "
+                       "read the file to store numbers: %s" % region.file_path)
+        return record_count - region.last_number_line + 1
+
+
+class SufficientCompressedNumbers(SufficientNumbersStorage):
+    '''
+    Computes the available numbers from a compressed region's block index.
+    '''
+
+    def get_available_count(self, region):
+        try:
+            line_count = blocks.get_line_count(region.file_path)
+        except (OSError, struct.error):
+            raise RuleError(
+                detail="An error occurred while opening attempting to "
+                       "read the file to store numbers: %s" % region.file_path)
+        return line_count - region.last_number_line + 1
+
+
+class SufficientSegmentedNumbers(SufficientNumbersStorage):
+    '''
+    Computes the available numbers from a segmented region's manifest.
+    '''
+
+    def get_available_count(self, region):
+        try:
+            return segments.get_available_count(region.file_path,
+                                                region.last_number_line)
+        except (OSError, ValueError):
+            raise RuleError(
+                detail="An error occurred while opening attempting to "
+                       "read the file to store numbers: %s" % region.file_path)
+
+
+class CompactConsumedNumbers(PostprocessingRule):
+    '''
+    Compacts a flat-file region once the share of consumed lines in its
+    file reaches the `compaction_ratio` processing parameter (e.g. 0.75).
+    Does nothing if the parameter is not set.  Set the
+    `compaction_archive` processing parameter to false to discard
+    consumed lines instead of archiving them.  Compaction runs in the
+    background, so allocations neither wait on it nor fail with it.
+    '''
+
+    @staticmethod
+    def is_due(region):
+        ratio = region.get_processing_parameter('compaction_ratio')
+        if not ratio:
+            return False
+        line_count = index.get_line_count(region.file_path)
+        return bool(line_count) and (
+                region.last_number_line - 1) / line_count >= float(ratio)
+
+    def execute(self, request, pool, region, size):
+        if self.is_due(region):
+            replenishment.run_in_background(('compact', region.pk),
+                                            compact_region, region.pk)
+
+
+def compact_region(region_pk):
+    '''
+    Compacts the region if it is still due for compaction.
+    '''
+    region = ListBasedRegion.objects.get(pk=region_pk)
+    if CompactConsumedNumbers.is_due(region):
+        archive = region.get_processing_parameter(
+            'compaction_archive', 'true').lower() != 'false'
+        compact_list_based_region(region, archive)
 
 
 def get_db_number_count(region):
     """
-    Returns the number of rows in a current sqlitedb being used for a given
-    db-region
+    Returns the number of unused rows in a current sqlitedb being used for
+    a given db-region.  The count is read from the database's inventory
+    counter rather than counted.
     :param region: The region to check.
     :return: The number of rows in the database.
     """
-    if not os.path.exists(region.db_file_path):
-        connection = sqlite3.connect(region.db_file_path)
-        connection.execute(
-            "create table if not exists %s "
-            "(serial_number text not null unique, used integer not null)"
-            % get_region_table(region)
-        )
-    else:
-        connection = sqlite3.connect(region.db_file_path)
-    cursor = connection.cursor()
-    sql = 'SELECT COUNT(*) FROM %s' % get_region_table(region)
-    print(sql)
-    result = cursor.execute(sql)
-    rows = result.fetchall()
-    return rows[0][0]
-
-
-
+    return sqlite.get_inventory(sqlite.get_region_connection(region),
+                                get_region_table(region))
 
 
 class SufficientDBNumbers(SufficientNumbersStorage):
@@ -152,7 +277,45 @@ class SufficientDBNumbers(SufficientNumbersStorage):
     Checks to see if there is enough in the current database to supply the
     request with numbers.
     """
+    def get_available_count(self, region):
+        return get_db_number_count(region)
+
+
+class SufficientShardedDBNumbers(SufficientDBNumbers):
+    """
+    Checks the combined inventory of all of a sharded DB region's shards.
+    """
+    def get_available_count(self, region):
+        table = get_region_table(region)
+        return sum(sqlite.get_inventory(
+            sqlite.get_region_connection(region, path), table)
+            for path in sqlite.get_shard_paths(region))
+
+
+class SufficientORMNumbers(SufficientNumbersStorage):
+    """
+    Checks the number of a region's numbers left in the ListBasedNumber
+    table.  Replenishments are only coalesced per host: the single-flight
+    lock is a file lock in the region's directory, so app nodes sharing
+    the table may each fetch a replenishment for the same shortfall.
+    """
+    def get_available_count(self, region):
+        return ListBasedNumber.objects.filter(
+            list_based_region=region).count()
+
+
+class ReclaimFreePages(PostprocessingRule):
+    '''
+    Returns up to `vacuum_pages` (a processing parameter) free pages of a
+    DB region's database to the file system after each allocation, so
+    space freed by claimed numbers is reclaimed in small steps.  Does
+    nothing if the parameter is not set or the database does not use
+    incremental auto_vacuum.
+    '''
+
     def execute(self, request, pool, region, size):
-        row_count = get_db_number_count(region)
-        if size > row_count:
-            self.fetch_more_numbers(request, pool, region, size - row_count)
+        pages = region.get_processing_parameter('vacuum_pages')
+        if pages:
+            for path in sqlite.get_shard_paths(region):
+                vacuum.reclaim_pages(
+                    sqlite.get_region_connection(region, path), int(pages))
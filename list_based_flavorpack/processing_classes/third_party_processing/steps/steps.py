@@ -15,7 +15,6 @@
 import os
 import uuid
 import time
-import sqlite3
 import requests
 from lxml import etree
 from urllib.parse import urlparse
@@ -26,9 +25,15 @@ from quartet_output import errors
 from quartet_output.transport.http import HttpTransportMixin, user_agent
 from quartet_output.models import EndPoint
 from quartet_capture import models, rules, errors as capture_errors
-from list_based_flavorpack.models import ListBasedRegion
+from django.db import transaction
+from django.db.models import Max
+from list_based_flavorpack.models import ListBasedRegion, ListBasedNumber
 from list_based_flavorpack.processing_classes.third_party_processing.rules import \
     get_region_table
+from list_based_flavorpack.storage import appender, fixed_width, segments, \
+    blocks, sqlite
+from list_based_flavorpack.storage.locks import lock_file
+from list_based_flavorpack.utils import vacuum_db_region
 
 
 class NumberRequestTransportStep(rules.Step, HttpTransportMixin):
@@ -247,14 +252,28 @@ class UUIDRequestStep(rules.Step):
 
     def persist_data(self, region, size):
         """
-        Saves the data to file.  Override to save it other places.
+        Saves the data to file and brings the file's offset index up to
+        date.  Override to save it other places.
         :param region: The region to save the data for.
         :param size: The number of UUIDs to generate.
         :return: None
         """
-        with open(region.file_path, "a") as f:
-            for i in range(size):
-                f.write("%s\n" % uuid.uuid1())
+        with lock_file(region.lock_file_path, shared=True):
+            # the file may have been swapped by compaction.
+            region.refresh_from_db(fields=['file_id'])
+            appender.append_lines(region.file_path,
+                                  (uuid.uuid1() for i in range(size)),
+                                  self.fsync_policy, self.buffer_lines)
+
+    @property
+    def fsync_policy(self):
+        return self.get_parameter('fsync-policy',
+                                  appender.DEFAULT_FSYNC_POLICY)
+
+    @property
+    def buffer_lines(self):
+        return int(self.get_parameter('buffer-size',
+                                      appender.DEFAULT_BUFFER_LINES))
 
     def on_failure(self):
         super().on_failure()
@@ -266,10 +285,87 @@ class UUIDRequestStep(rules.Step):
                             'http posts, puts, etc. Default is application/'
                             'xml',
             'file-extension': 'The file extension to specify when posting and '
-                              'putting data via http. Default is xml'
+                              'putting data via http. Default is xml',
+            'fsync-policy': 'When to fsync numbers written to file: buffer, '
+                            'batch or never. Default is batch',
+            'buffer-size': 'The number of lines written per write call. '
+                           'Default is 50000'
         }
 
 
+class FixedWidthUUIDRequestStep(UUIDRequestStep):
+    """
+    Saves the UUIDs as fixed-width records for use with the
+    FixedWidthProcessingClass.
+    """
+
+    def persist_data(self, region, size):
+        with lock_file(region.lock_file_path, shared=True):
+            region.refresh_from_db(fields=['file_id'])
+            fixed_width.append_records(
+                region.file_path, [str(uuid.uuid1()) for i in range(size)],
+                self.fsync_policy)
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        # records are written in a single call.
+        del params['buffer-size']
+        return params
+
+
+class SegmentedUUIDRequestStep(UUIDRequestStep):
+    """
+    Saves the UUIDs as new segment files for use with the
+    SegmentedProcessingClass.
+    """
+
+    def persist_data(self, region, size):
+        segment_size = int(self.get_parameter('segment-size', 10000))
+        with lock_file(region.lock_file_path):
+            region.refresh_from_db(fields=['file_id'])
+            count = segments.append_segments(
+                region.file_path, [str(uuid.uuid1()) for i in range(size)],
+                segment_size, self.fsync_policy)
+        self.info('Wrote %s segments.', count)
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        del params['buffer-size']
+        params['segment-size'] = 'The maximum number of lines in each ' \
+                                 'segment file. Default is 10000'
+        return params
+
+
+class CompressedUUIDRequestStep(UUIDRequestStep):
+    """
+    Saves the UUIDs as compressed blocks for use with the
+    CompressedProcessingClass.
+    """
+
+    def persist_data(self, region, size):
+        block_size = int(self.get_parameter('block-size',
+                                            blocks.DEFAULT_BLOCK_SIZE))
+        codec = self.get_parameter('codec', 'zlib')
+        with lock_file(region.lock_file_path, shared=True):
+            region.refresh_from_db(fields=['file_id'])
+            count = blocks.append_blocks(
+                region.file_path, [str(uuid.uuid1()) for i in range(size)],
+                block_size, codec, self.fsync_policy)
+        self.info('Wrote %s compressed blocks.', count)
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        del params['buffer-size']
+        params['block-size'] = 'The number of lines in each compressed ' \
+                               'block. Default is 1000'
+        params['codec'] = 'The compression to use: zlib or lzma. ' \
+                          'Default is zlib'
+        return params
+
+
 class UUIDRequestDBStep(UUIDRequestStep):
     """
     Instead of saving data to file will save to a sqlite3 database file.
@@ -277,13 +373,135 @@ class UUIDRequestDBStep(UUIDRequestStep):
 
     def persist_data(self, region, size):
         start = time.time()
-        connection = sqlite3.connect(region.db_file_path)
-        cursor = connection.cursor()
-        cursor.execute('begin transaction')
         self.info('storing the numbers.')
-        for i in range(size):
-            cursor.execute('insert into %s (serial_number, used) '
-                           'values (?, ?)' % get_region_table(region),
-                           (str(uuid.uuid1()), 0))
-        cursor.execute('commit')
-        self.info("Execution time: %.3f seconds." % (time.time() - start))
+        # a full vacuum holds the region lock exclusively.
+        with lock_file(region.lock_file_path, shared=True):
+            count = sqlite.insert_numbers(
+                sqlite.get_region_connection(region),
+                get_region_table(region),
+                (uuid.uuid1() for i in range(size)), self.chunk_size)
+        elapsed = time.time() - start
+        self.info("Stored %s numbers in %.3f seconds (%.0f rows/sec).",
+                  count, elapsed, count / elapsed if elapsed else count)
+
+    @property
+    def chunk_size(self):
+        return int(self.get_parameter('chunk-size',
+                                      sqlite.DEFAULT_CHUNK_SIZE))
+
+    @property
+    def declared_parameters(self):
+        params = super().declared_parameters
+        # the numbers go to a database, not a number file.
+        del params['fsync-policy']
+        del params['buffer-size']
+        params['chunk-size'] = 'The number of rows inserted and committed ' \
+                               'per transaction. Default is 10000'
+        return params
+
+
+class ShardedUUIDRequestDBStep(UUIDRequestDBStep):
+    """
+    Spreads the UUIDs evenly across the shards of a region using the
+    ShardedDBProcessingClass.  Shards are dealt to in order of their
+    inventory, lowest first, so the numbers left over after an even
+    split, or all of a replenishment smaller than the shard count, go to
+    the emptiest shards.
+    """
+
+    def persist_data(self, region, size):
+        start = time.time()
+        table = get_region_table(region)
+        paths = sqlite.get_shard_paths(region)
+        self.info('storing the numbers across %s shards.', len(paths))
+        count = 0
+        with lock_file(region.lock_file_path, shared=True):
+            inventory = {path: sqlite.get_inventory(
+                sqlite.get_region_connection(region, path), table)
+                for path in paths}
+            paths.sort(key=inventory.get)
+            for shard, path in enumerate(paths):
+                shard_size = size // len(paths) + (
+                    shard < size % len(paths))
+                count += sqlite.insert_numbers(
+                    sqlite.get_region_connection(region, path), table,
+                    (uuid.uuid1() for i in range(shard_size)),
+                    self.chunk_size)
+        elapsed = time.time() - start
+        self.info("Stored %s numbers in %.3f seconds (%.0f rows/sec).",
+                  count, elapsed, count / elapsed if elapsed else count)
+
+
+class ORMUUIDRequestStep(UUIDRequestDBStep):
+    """
+    Saves the UUIDs to the ListBasedNumber table for use with the
+    ORMProcessingClass.
+    """
+
+    def persist_data(self, region, size):
+        start = time.time()
+        self.info('storing the numbers.')
+        count = 0
+        while count < size:
+            chunk_size = min(self.chunk_size, size - count)
+            with transaction.atomic():
+                # locking the region serializes sequence assignment
+                # between concurrent ingests.
+                ListBasedRegion.objects.select_for_update().only('pk').get(
+                    pk=region.pk)
+                sequence = ListBasedNumber.objects.filter(
+                    list_based_region=region).aggregate(
+                    Max('sequence'))['sequence__max'] or 0
+                ListBasedNumber.objects.bulk_create(
+                    [ListBasedNumber(list_based_region=region,
+                                     sequence=sequence + i + 1,
+                                     serial_number=str(uuid.uuid1()))
+                     for i in range(chunk_size)],
+                    batch_size=self.chunk_size)
+            count += chunk_size
+        elapsed = time.time() - start
+        self.info("Stored %s numbers in %.3f seconds (%.0f rows/sec).",
+                  count, elapsed, count / elapsed if elapsed else count)
+
+
+class VacuumDBRegionStep(rules.Step):
+    """
+    Reclaims the free pages of DB region databases.  Meant to be run on
+    a schedule; set the `full` parameter for runs in quiet windows.
+    Logs the pages reclaimed and the time spent for each region.
+    """
+
+    def execute(self, data, rule_context: RuleContext):
+        machine_names = self.get_parameter('regions', None)
+        if machine_names:
+            regions = ListBasedRegion.objects.filter(
+                machine_name__in=[name.strip() for name in
+                                  machine_names.split(',')])
+        else:
+            regions = ListBasedRegion.objects.filter(
+                processing_class_path__endswith='DBProcessingClass')
+        max_pages = int(self.get_parameter('max-pages', 1000))
+        full = self.get_parameter('full', 'false').lower() == 'true'
+        for region in regions:
+            metrics = vacuum_db_region(region, max_pages, full)
+            self.info('Reclaimed %s pages from region %s in %.3f seconds; '
+                      '%s pages with %s free remain.',
+                      metrics['reclaimed_pages'], region.machine_name,
+                      metrics['seconds'], metrics['page_count'],
+                      metrics['free_pages'])
+
+    def on_failure(self):
+        super().on_failure()
+
+    @property
+    def declared_parameters(self):
+        return {
+            'regions': 'A comma separated list of the machine names of the '
+                       'regions to vacuum. Default is every DB and sharded '
+                       'DB region',
+            'max-pages': 'The most free pages to reclaim from each region. '
+                         'Default is 1000',
+            'full': 'Set to true to rebuild each database with a full '
+                    'vacuum, blocking allocations meanwhile. Default is '
+                    'false'
+        }
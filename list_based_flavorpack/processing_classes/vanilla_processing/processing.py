@@ -17,6 +17,7 @@
     along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import uuid
+from list_based_flavorpack import cursor
 from list_based_flavorpack.processing_classes.vanilla_processing.rules import NoOddRequests
 
 
@@ -45,8 +46,8 @@ class VanillaProcessingClass:
         return self.post_processing_rules
     
     def get_items(self, region, size):
-        first = region.last_number_line
-        max_line = first + size
-        region.last_number_line =  max_line
-        region.save()
-        return [str(uuid.uuid1()) for i in range(first, max_line)]
+        if cursor.uses_journal(region):
+            cursor.reserve(region, size)
+            return [str(uuid.uuid1()) for i in range(size)]
+        region.last_number_line = cursor.advance_cursor(region, size)
+        return [str(uuid.uuid1()) for i in range(size)]
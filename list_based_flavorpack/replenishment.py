@@ -0,0 +1,159 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+
+    Coordinates replenishments so that only one runs per region at a
+    time, and replenishes regions whose inventory has dropped below
+    their `low_watermark` processing parameter in the background, so
+    allocations only wait on the third-party system when inventory is
+    actually exhausted.  Other region maintenance, such as compaction,
+    runs on the same background threads.
+'''
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.db import connections
+
+from list_based_flavorpack import list_based_flavorpack_settings as settings
+from list_based_flavorpack.models import ListBasedRegion
+from list_based_flavorpack.storage.locks import try_lock_file
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_in_flight = set()
+_lock = threading.Lock()
+
+
+def get_lock_path(region):
+    return os.path.join(region.directory_path,
+                        '%s.replenish.lock' % region.database_name)
+
+
+def get_timeout(region):
+    '''
+    Returns how many seconds an allocation waits for another request's
+    replenishment of the region: its `replenishment_timeout` processing
+    parameter or the REPLENISHMENT_TIMEOUT setting.
+    '''
+    return float(region.get_processing_parameter(
+        'replenishment_timeout', settings.REPLENISHMENT_TIMEOUT))
+
+
+@contextmanager
+def single_flight(region, timeout):
+    '''
+    Holds the region's replenishment lock, a file lock in its directory
+    shared by every process on the host, for the duration of the `with`
+    block.  Waits up to `timeout` seconds for a replenishment already
+    running elsewhere and yields whether or not the lock was acquired;
+    either way, callers should re-check the region's inventory before
+    fetching.
+    '''
+    os.makedirs(region.directory_path, exist_ok=True)
+    with try_lock_file(get_lock_path(region), timeout) as acquired:
+        yield acquired
+
+
+def get_low_watermark(region):
+    '''
+    Returns the region's `low_watermark` processing parameter, 0 if it
+    does not replenish in the background.
+    '''
+    return int(region.get_processing_parameter('low_watermark', 0))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.REPLENISHMENT_WORKERS,
+            thread_name_prefix='list-based-replenishment')
+    return _executor
+
+
+def _after_fork():
+    # a forked worker inherits the executor but none of its threads.
+    global _executor, _in_flight, _lock
+    _executor = None
+    _in_flight = set()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def run_in_background(key, function, *args):
+    '''
+    Queues `function(*args)` on the background executor unless a task
+    with the same key is already queued or running in this process.
+    Failures are logged.  Returns True if it was queued.
+    '''
+    with _lock:
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+    try:
+        _get_executor().submit(_run, key, function, *args)
+    except Exception:
+        with _lock:
+            _in_flight.discard(key)
+        raise
+    return True
+
+
+def replenish_async(rule, region):
+    '''
+    Queues a background replenishment of the region using the rule's
+    fetch_more_numbers unless one is already queued or running in this
+    process.  Returns True if one was queued.
+    :param rule: The SufficientNumbersStorage rule checking the region.
+    :param region: The region to replenish.
+    '''
+    return run_in_background(('replenish', region.pk), replenish,
+                             type(rule), region.pk)
+
+
+def _run(key, function, *args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Background task %s for region %s failed.', *key)
+    finally:
+        with _lock:
+            _in_flight.discard(key)
+        connections.close_all()
+
+
+def replenish(rule_class, region_pk):
+    '''
+    Fetches a replenishment for the region if its inventory is still
+    below its low watermark and no other replenishment of it is running.
+    Returns True if numbers were fetched.
+    '''
+    region = ListBasedRegion.objects.get(pk=region_pk)
+    rule = rule_class()
+    # skip it if another process is already replenishing.
+    with single_flight(region, 0) as acquired:
+        if not acquired or rule.get_available_count(
+                region) >= get_low_watermark(region):
+            return False
+        rule.fetch_more_numbers(None, region.pool, region, 0)
+        return True
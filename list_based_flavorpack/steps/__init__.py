@@ -1,2 +1,5 @@
 from list_based_flavorpack.processing_classes.third_party_processing.steps.steps import \
-    NumberRequestTransportStep, UUIDRequestStep, UUIDRequestDBStep
+    NumberRequestTransportStep, UUIDRequestStep, UUIDRequestDBStep, \
+    FixedWidthUUIDRequestStep, SegmentedUUIDRequestStep, \
+    CompressedUUIDRequestStep, ShardedUUIDRequestDBStep, ORMUUIDRequestStep, \
+    VacuumDBRegionStep
@@ -0,0 +1,18 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
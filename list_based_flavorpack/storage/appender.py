@@ -0,0 +1,103 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+from itertools import islice
+
+from list_based_flavorpack.storage import index
+from list_based_flavorpack.storage.locks import locked
+
+# buffer: fsync after every buffer written
+# batch: fsync once after the whole batch has been written
+# never: leave flushing to the operating system
+FSYNC_POLICIES = ('buffer', 'batch', 'never')
+DEFAULT_FSYNC_POLICY = 'batch'
+DEFAULT_BUFFER_LINES = 50000
+
+
+def check_fsync_policy(fsync_policy):
+    if fsync_policy not in FSYNC_POLICIES:
+        raise ValueError('The fsync policy must be one of %s, not %s.' %
+                         (', '.join(FSYNC_POLICIES), fsync_policy))
+
+
+def sync(f, fsync_policy=DEFAULT_FSYNC_POLICY):
+    '''
+    Flushes a file and fsyncs it unless the policy is never.
+    '''
+    f.flush()
+    if fsync_policy != 'never':
+        os.fsync(f.fileno())
+
+
+def write_lines(f, numbers, fsync_policy=DEFAULT_FSYNC_POLICY,
+                buffer_lines=DEFAULT_BUFFER_LINES):
+    '''
+    Writes numbers as lines, building each buffer of `buffer_lines`
+    lines into a single payload and write() call.
+    :return: The number of lines written.
+    '''
+    check_fsync_policy(fsync_policy)
+    numbers = iter(numbers)
+    written = 0
+    while True:
+        buffer = list(islice(numbers, buffer_lines))
+        if not buffer:
+            break
+        f.write(''.join('%s\n' % number for number in buffer).encode())
+        written += len(buffer)
+        if fsync_policy == 'buffer':
+            sync(f, fsync_policy)
+    sync(f, fsync_policy)
+    return written
+
+
+def append_lines(file_path, numbers, fsync_policy=DEFAULT_FSYNC_POLICY,
+                 buffer_lines=DEFAULT_BUFFER_LINES):
+    '''
+    Appends numbers to a plain-text number file and then publishes them
+    by syncing the file's offset index.  Readers only see indexed lines,
+    so they never see a partially written one.  A partial line left
+    behind by an interrupted write is cut off before appending so the
+    new numbers are not glued onto it.
+    :return: The number of lines written.
+    '''
+    # before the file is touched, so a bad policy changes nothing.
+    check_fsync_policy(fsync_policy)
+    # creates the file if it is missing; writes always go to the end.
+    with open(file_path, 'a+b') as f:
+        with locked(f):
+            f.truncate(index.get_indexed_size(file_path))
+            written = write_lines(f, numbers, fsync_policy, buffer_lines)
+    index.sync_index(file_path)
+    return written
+
+
+def write_file(file_path, numbers, fsync_policy=DEFAULT_FSYNC_POLICY,
+               buffer_lines=DEFAULT_BUFFER_LINES):
+    '''
+    Writes numbers to a temp file next to `file_path` and atomically
+    renames it into place.
+    :return: The number of lines written.
+    '''
+    check_fsync_policy(fsync_policy)
+    temp_path = '%s.tmp' % file_path
+    with open(temp_path, 'wb') as f:
+        written = write_lines(f, numbers, fsync_policy, buffer_lines)
+    os.replace(temp_path, file_path)
+    return written
@@ -0,0 +1,154 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+
+    An append-only record of the numbers each allocation issued.  Each
+    archive is a SQLite database with an `allocations` table and a
+    `consumed` table mapping every issued number to its allocation,
+    indexed by number.  Allocations only append a line to the archive's
+    log, which is fsynced but never read on the allocation path; `flush`
+    moves everything logged into the database in one transaction and
+    empties the log.  Flushing is idempotent, so a log that outlives a
+    crash is simply flushed again.
+'''
+import json
+import logging
+import os
+
+from list_based_flavorpack.storage import appender, sqlite
+from list_based_flavorpack.storage.locks import locked
+
+logger = logging.getLogger(__name__)
+
+
+def get_log_path(archive_path):
+    return '%s.log' % archive_path
+
+
+def create_archive(connection):
+    connection.executescript('''
+        create table if not exists allocations (
+            allocation_id text not null unique,
+            region text not null,
+            issued real not null,
+            size integer not null);
+        create table if not exists consumed (
+            serial_number text not null,
+            allocation integer not null);
+        create index if not exists consumed_serial_number
+            on consumed (serial_number);
+    ''')
+
+
+def get_archive_connection(archive_path):
+    '''
+    Returns this thread's connection to an archive, creating its tables
+    when the connection is opened.
+    '''
+    return sqlite.get_connection(archive_path, setup=create_archive)
+
+
+def write_allocations(archive_path, allocations):
+    '''
+    Appends allocations to an archive in a single transaction.
+    Allocations already in the archive are skipped.
+    :param archive_path: The archive database's path.
+    :param allocations: (allocation_id, region, issued, numbers) tuples.
+    '''
+    connection = get_archive_connection(archive_path)
+    with connection:
+        for allocation_id, region, issued, numbers in allocations:
+            cursor = connection.execute(
+                'insert or ignore into allocations (allocation_id, region, '
+                'issued, size) values (?, ?, ?, ?)',
+                (allocation_id, region, issued, len(numbers)))
+            if not cursor.rowcount:
+                continue
+            connection.executemany(
+                'insert into consumed (serial_number, allocation) '
+                'values (?, ?)',
+                ((str(number), cursor.lastrowid) for number in numbers))
+
+
+def record(archive_path, allocation_id, region, issued, numbers):
+    '''
+    Appends an allocation to the archive's log; call `flush` to move it
+    into the archive.  Never raises, since the numbers have already been
+    issued: if the allocation can't be logged its numbers are logged
+    with the error instead so they can still be traced.
+    :param archive_path: The archive database's path.
+    :param allocation_id: A unique id for the allocation.
+    :param region: The machine name of the region that issued the numbers.
+    :param issued: The time the numbers were issued as a UNIX timestamp.
+    :param numbers: The numbers issued.
+    :return: True if the allocation was logged.
+    '''
+    try:
+        entry = json.dumps([allocation_id, region, issued,
+                            [str(number) for number in numbers]])
+        with open(get_log_path(archive_path), 'ab') as log:
+            with locked(log):
+                log.write(('%s\n' % entry).encode())
+                appender.sync(log)
+        return True
+    except Exception:
+        logger.exception('Could not archive allocation %s of region %s '
+                         'to %s.  Its numbers were: %s', allocation_id,
+                         region, archive_path, numbers)
+        return False
+
+
+def flush(archive_path):
+    '''
+    Moves the allocations in the archive's log into the archive in a
+    single transaction and empties the log.
+    :return: The number of allocations moved.
+    '''
+    try:
+        log = open(get_log_path(archive_path), 'r+b')
+    except FileNotFoundError:
+        return 0
+    with log:
+        with locked(log):
+            lines = log.read().split(b'\n')
+            if lines[-1]:
+                # only a writer that died mid-write leaves one behind.
+                logger.warning('Discarding an incomplete entry in the log '
+                               'of archive %s: %r', archive_path, lines[-1])
+            allocations = [json.loads(line) for line in lines[:-1]]
+            if allocations:
+                write_allocations(archive_path, allocations)
+            log.truncate(0)
+    return len(allocations)
+
+
+def find_allocation(archive_path, serial_number):
+    '''
+    Returns the allocation that issued a number as a dictionary with the
+    allocation_id, region, issued time and size, or None if the archive
+    has no record of it.  The archive's log is flushed first.
+    '''
+    flush(archive_path)
+    if not os.path.exists(archive_path):
+        return None
+    row = get_archive_connection(archive_path).execute(
+        'select a.allocation_id, a.region, a.issued, a.size '
+        'from consumed c join allocations a on a.rowid = c.allocation '
+        'where c.serial_number = ? order by a.rowid desc limit 1',
+        (str(serial_number),)).fetchone()
+    if row:
+        return dict(zip(('allocation_id', 'region', 'issued', 'size'), row))
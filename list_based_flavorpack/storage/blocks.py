@@ -0,0 +1,190 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import lzma
+import os
+import struct
+import zlib
+
+from list_based_flavorpack.storage import appender
+from list_based_flavorpack.storage.locks import locked
+
+# first line, line count, byte offset, byte length, codec
+ENTRY = struct.Struct('<QIQIB')
+CODECS = {
+    'zlib': (0, zlib.compress, zlib.decompress),
+    'lzma': (1, lzma.compress, lzma.decompress),
+}
+DECOMPRESSORS = {codec_id: decompress for codec_id, compress, decompress
+                 in CODECS.values()}
+DEFAULT_BLOCK_SIZE = 1000
+
+
+def get_block_index_path(file_path):
+    '''
+    Returns the path of the block index stored next to a compressed
+    number file.
+    '''
+    return '%s.blk' % file_path
+
+
+def _read_entry(index_file, position):
+    index_file.seek(position * ENTRY.size)
+    return ENTRY.unpack(index_file.read(ENTRY.size))
+
+
+def _entry_count(index_file):
+    return os.fstat(index_file.fileno()).st_size // ENTRY.size
+
+
+def get_line_count(file_path):
+    '''
+    Returns the number of lines stored without touching the data file.
+    '''
+    try:
+        with open(get_block_index_path(file_path), 'rb') as index_file:
+            with locked(index_file, shared=True):
+                count = _entry_count(index_file)
+                if not count:
+                    return 0
+                first_line, line_count = _read_entry(index_file,
+                                                     count - 1)[:2]
+                return first_line + line_count - 1
+    except FileNotFoundError:
+        return 0
+
+
+def append_blocks(file_path, numbers, block_size=DEFAULT_BLOCK_SIZE,
+                  codec='zlib', fsync_policy=appender.DEFAULT_FSYNC_POLICY):
+    '''
+    Compresses numbers into independent blocks of `block_size` lines,
+    appends them to the data file in one write and then publishes them
+    by appending their entries to the block index.
+    :param file_path: The full path to the compressed number file.
+    :param numbers: A list of numbers.
+    :param block_size: The number of lines per block.
+    :param codec: zlib or lzma.
+    :param fsync_policy: One of `appender.FSYNC_POLICIES`.
+    :return: The number of blocks written.
+    '''
+    appender.check_fsync_policy(fsync_policy)
+    codec_id, compress = CODECS[codec][:2]
+    with open(get_block_index_path(file_path), 'a+b') as index_file:
+        with locked(index_file):
+            count = _entry_count(index_file)
+            if count:
+                first_line, line_count, offset, length = _read_entry(
+                    index_file, count - 1)[:4]
+                next_line, offset = first_line + line_count, offset + length
+            else:
+                next_line, offset = 1, 0
+            published_size = offset
+            blocks, entries = [], []
+            for start in range(0, len(numbers), block_size):
+                chunk = numbers[start:start + block_size]
+                block = compress(
+                    ''.join('%s\n' % number for number in chunk).encode())
+                blocks.append(block)
+                entries.append(ENTRY.pack(next_line, len(chunk), offset,
+                                          len(block), codec_id))
+                next_line += len(chunk)
+                offset += len(block)
+            with open(file_path, 'a+b') as f:
+                # anything past the last indexed block was never published.
+                f.truncate(published_size)
+                f.write(b''.join(blocks))
+                appender.sync(f, fsync_policy)
+            index_file.write(b''.join(entries))
+    return len(blocks)
+
+
+def _find_block(index_file, count, line):
+    '''
+    Binary searches the index for the block holding `line`.
+    '''
+    low, high = 0, count - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _read_entry(index_file, middle)[0] <= line:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def read_lines(file_path, first, size):
+    '''
+    Reads `size` lines starting at line number `first`, decompressing
+    only the blocks that cover them.
+    '''
+    if size < 1:
+        return []
+    end = first + size
+    with open(get_block_index_path(file_path), 'rb') as index_file:
+        with locked(index_file, shared=True):
+            count = _entry_count(index_file)
+            entries = []
+            if count and first >= 1:
+                position = _find_block(index_file, count, first)
+                while position < count:
+                    entry = _read_entry(index_file, position)
+                    entries.append(entry)
+                    if entry[0] + entry[1] >= end:
+                        break
+                    position += 1
+    if not entries or entries[-1][0] + entries[-1][1] < end:
+        raise ValueError(
+            "There are not enough numbers available for this iteration "
+            "starting on line number: %s" % first)
+    start = entries[0][2]
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(entries[-1][2] + entries[-1][3] - start)
+    lines = []
+    for first_line, line_count, offset, length, codec_id in entries:
+        block = DECOMPRESSORS[codec_id](
+            data[offset - start:offset - start + length])
+        lines += block.decode().split('\n')[
+                 max(first - first_line, 0):min(end - first_line, line_count)]
+    return lines
+
+
+def convert_file(source_path, file_path, block_size=DEFAULT_BLOCK_SIZE,
+                 codec='zlib'):
+    '''
+    Streams a plain-text number file into the compressed format, one
+    block at a time, keeping the original line numbers.
+    :return: The number of lines converted.
+    '''
+    open(file_path, 'wb').close()
+    converted = 0
+    with open(source_path) as source:
+        chunk = []
+        for line in source:
+            if not line.endswith('\n'):
+                # an incomplete trailing line has not been issued yet.
+                break
+            chunk.append(line.strip())
+            if len(chunk) == block_size:
+                converted += len(chunk)
+                append_blocks(file_path, chunk, block_size, codec)
+                chunk = []
+        if chunk:
+            converted += len(chunk)
+            append_blocks(file_path, chunk, block_size, codec)
+    return converted
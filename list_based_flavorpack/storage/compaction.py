@@ -0,0 +1,52 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import gzip
+import os
+import shutil
+
+from list_based_flavorpack.storage import index
+
+
+def compact_file(file_path, new_file_path, first_line, archive_path=None):
+    '''
+    Copies every line from `first_line` onwards into a new, indexed,
+    number file.  The consumed lines before `first_line` are optionally
+    gzipped to `archive_path`.
+    :param file_path: The number file to compact.
+    :param new_file_path: Where to write the unconsumed lines.
+    :param first_line: The first unconsumed line number.
+    :param archive_path: Where to archive consumed lines or None.
+    :return: The number of consumed lines removed.
+    '''
+    start = index.get_line_start(file_path, first_line)
+    with open(file_path, 'rb') as src:
+        if archive_path:
+            with gzip.open(archive_path, 'wb') as archive:
+                remaining = start
+                while remaining:
+                    chunk = src.read(min(remaining, index.SCAN_CHUNK_SIZE))
+                    archive.write(chunk)
+                    remaining -= len(chunk)
+        src.seek(start)
+        with open(new_file_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, index.SCAN_CHUNK_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+    index.sync_index(new_file_path)
+    return min(first_line - 1, index.get_line_count(file_path))
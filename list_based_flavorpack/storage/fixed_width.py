@@ -0,0 +1,132 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import struct
+
+from list_based_flavorpack.storage import appender
+from list_based_flavorpack.storage.locks import locked
+
+# magic, format version, flags, record width in bytes
+HEADER = struct.Struct('<4sBBxxI')
+MAGIC = b'LBFW'
+VERSION = 1
+# set once any record shorter than the width has been space-padded.
+FLAG_PADDED = 0x01
+PADDING = b' '
+
+
+def read_header(f):
+    '''
+    Reads the header of an open fixed-width file.
+    :return: A (width, flags) tuple or None if the file has no records yet.
+    '''
+    f.seek(0)
+    data = f.read(HEADER.size)
+    if not data:
+        return None
+    magic, version, flags, width = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a fixed-width number file.' % f.name)
+    return width, flags
+
+
+def append_records(file_path, numbers,
+                   fsync_policy=appender.DEFAULT_FSYNC_POLICY):
+    '''
+    Appends numbers as fixed-width records in a single write.  The width
+    is taken from the longest number of the first batch written to the
+    file and recorded in the header.  Shorter numbers are space-padded.
+    A partial record left behind by an interrupted write is cut off
+    first so later records stay aligned.
+    :param file_path: The full path to the number file.
+    :param numbers: An iterable of ascii numbers.
+    :param fsync_policy: One of `appender.FSYNC_POLICIES`.
+    :return: The number of records written.
+    '''
+    appender.check_fsync_policy(fsync_policy)
+    encoded = [number.encode('ascii') for number in numbers]
+    if not encoded:
+        return 0
+    with open(file_path, 'a+b') as f:
+        with locked(f):
+            header = read_header(f)
+            width, flags = header or (
+                max(len(number) for number in encoded), 0)
+            if any(len(number) > width for number in encoded):
+                raise ValueError('Numbers may not be longer than the %s '
+                                 'byte record width of %s.' %
+                                 (width, file_path))
+            if any(len(number) < width for number in encoded):
+                flags |= FLAG_PADDED
+            if not header:
+                f.write(HEADER.pack(MAGIC, VERSION, flags, width))
+            else:
+                f.truncate(HEADER.size + _count(f, width) * width)
+            if header and flags != header[1]:
+                # positional writes on an append handle go to the end.
+                with open(file_path, 'r+b') as header_file:
+                    header_file.write(
+                        HEADER.pack(MAGIC, VERSION, flags, width))
+            f.write(b''.join(number.ljust(width, PADDING)
+                             for number in encoded))
+            appender.sync(f, fsync_policy)
+    return len(encoded)
+
+
+def _count(f, width):
+    # trailing bytes short of a whole record are ignored.
+    return (os.fstat(f.fileno()).st_size - HEADER.size) // width
+
+
+def get_record_count(file_path):
+    '''
+    Returns the number of complete records in the file.
+    '''
+    with open(file_path, 'rb') as f:
+        with locked(f, shared=True):
+            header = read_header(f)
+            if not header:
+                return 0
+            return _count(f, header[0])
+
+
+def read_records(file_path, first, size):
+    '''
+    Reads `size` records starting at record number `first` (1-based)
+    with a single read at an offset computed from the record width.  The
+    file's lock is held shared so the header and records are read as
+    written together.
+    '''
+    if size < 1:
+        return []
+    with open(file_path, 'rb') as f:
+        with locked(f, shared=True):
+            header = read_header(f)
+            width, flags = header or (1, 0)
+            f.seek(HEADER.size + (first - 1) * width)
+            data = f.read(size * width) if header else b''
+    if first < 1 or len(data) < size * width:
+        raise ValueError(
+            "There are not enough numbers available for this iteration "
+            "starting on line number: %s" % first)
+    text = data.decode('ascii')
+    if flags & FLAG_PADDED:
+        return [text[i:i + width].rstrip() for i in
+                range(0, len(text), width)]
+    return [text[i:i + width] for i in range(0, len(text), width)]
@@ -0,0 +1,166 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import struct
+import sys
+from array import array
+
+from list_based_flavorpack.storage.locks import locked
+
+# each entry is the byte offset just past the newline of a line, so
+# line N spans entry N-1 (exclusive start) to entry N (inclusive end).
+ENTRY = struct.Struct('<Q')
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def get_index_path(file_path):
+    '''
+    Returns the path of the offset index stored next to a number file.
+    '''
+    return '%s.idx' % file_path
+
+
+def _read_entry(index_file, position):
+    index_file.seek(position * ENTRY.size)
+    return ENTRY.unpack(index_file.read(ENTRY.size))[0]
+
+
+def _scan_line_ends(file_path, offset):
+    '''
+    Returns the end offsets of every complete line in the file from
+    `offset` onwards.  A trailing line without a newline is not
+    returned until it has been completed.
+    '''
+    ends = array('Q')
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            position = chunk.find(b'\n')
+            while position != -1:
+                ends.append(offset + position + 1)
+                position = chunk.find(b'\n', position + 1)
+            offset += len(chunk)
+    if sys.byteorder != 'little':
+        ends.byteswap()
+    return ends
+
+
+def sync_index(file_path):
+    '''
+    Brings the index for `file_path` up to date by scanning only the
+    bytes appended since the last sync.  Should be called by anything
+    that appends numbers to the file.
+    :param file_path: The full path to the number file.
+    :return: The number of complete lines in the file.
+    '''
+    with open(get_index_path(file_path), 'a+b') as index_file:
+        with locked(index_file):
+            count = os.fstat(index_file.fileno()).st_size // ENTRY.size
+            last_end = _read_entry(index_file, count - 1) if count else 0
+            data_size = os.path.getsize(file_path)
+            if data_size < last_end:
+                # the file was replaced or truncated, start over.
+                index_file.truncate(0)
+                count, last_end = 0, 0
+            if data_size == last_end:
+                return count
+            ends = _scan_line_ends(file_path, last_end)
+            index_file.write(ends.tobytes())
+            return count + len(ends)
+
+
+def get_line_count(file_path):
+    '''
+    Returns the number of indexed lines without touching the number file.
+    '''
+    try:
+        return os.path.getsize(get_index_path(file_path)) // ENTRY.size
+    except FileNotFoundError:
+        return 0
+
+
+def get_line_start(file_path, line):
+    '''
+    Returns the byte offset at which line number `line` starts.  Lines
+    past the end of the file start at the end of the last complete line.
+    '''
+    count = sync_index(file_path)
+    line = min(line, count + 1)
+    if line < 2:
+        return 0
+    with open(get_index_path(file_path), 'rb') as index_file:
+        with locked(index_file, shared=True):
+            return _read_entry(index_file, line - 2)
+
+
+def get_indexed_size(file_path):
+    '''
+    Returns the byte offset just past the last complete line.
+    '''
+    return get_line_start(file_path, sync_index(file_path) + 1)
+
+
+def get_byte_range(file_path, first, size):
+    '''
+    Returns the (start, end) byte offsets of `size` lines beginning at
+    line number `first` (1-based).  Raises a ValueError if the file does
+    not hold that many lines.
+    '''
+    count = sync_index(file_path)
+    last = first + size - 1
+    if first < 1 or last > count:
+        raise ValueError(
+            "There are not enough numbers available for this iteration "
+            "starting on line number: %s" % first)
+    with open(get_index_path(file_path), 'rb') as index_file:
+        with locked(index_file, shared=True):
+            start = _read_entry(index_file, first - 2) if first > 1 else 0
+            end = _read_entry(index_file, last - 1)
+    return start, end
+
+
+def split_lines(data, first=1):
+    '''
+    Splits a block of newline-terminated lines into a list of numbers,
+    raising a ValueError if any of them are blank.
+    '''
+    lines = [line.strip() for line in data.split('\n')[:-1]]
+    if not all(lines):
+        raise ValueError(
+            "There are not enough numbers available for this iteration "
+            "starting on line number: %s" % (first + lines.index('')))
+    return lines
+
+
+def read_lines(file_path, first, size):
+    '''
+    Reads exactly `size` lines starting at line number `first` by
+    seeking straight to them, so memory use is proportional to the
+    request rather than the file.
+    '''
+    if size < 1:
+        return []
+    start, end = get_byte_range(file_path, first, size)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return split_lines(data.decode('utf-8'), first)
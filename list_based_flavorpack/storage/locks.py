@@ -0,0 +1,78 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import fcntl
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(file_object, shared=False):
+    '''
+    Holds an advisory lock on an open file for the duration of the
+    `with` block.  Shared locks may be held by any number of readers,
+    exclusive locks by a single writer.  Buffered writes are flushed
+    before the lock is released.
+    :param file_object: An open file object.
+    :param shared: Set to True to take a shared (reader) lock.
+    '''
+    fcntl.flock(file_object.fileno(),
+                fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    try:
+        yield file_object
+    finally:
+        if not shared:
+            file_object.flush()
+        fcntl.flock(file_object.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock_file(path, shared=False):
+    '''
+    Holds an advisory lock on the file at `path`, creating it if needed.
+    Used to coordinate work on a region between processes.
+    '''
+    with open(path, 'a') as f:
+        with locked(f, shared):
+            yield
+
+
+@contextmanager
+def try_lock_file(path, timeout=0, poll_interval=0.05):
+    '''
+    Like `lock_file` with an exclusive lock, but gives up waiting after
+    `timeout` seconds.  Yields whether or not the lock was acquired; the
+    `with` block runs either way.
+    '''
+    with open(path, 'a') as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    acquired = False
+                    break
+                time.sleep(poll_interval)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,85 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import mmap
+import os
+import threading
+
+from list_based_flavorpack.storage import index
+
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+def get_mapping(file_path, required_size):
+    '''
+    Returns a read-only memory map of `file_path` covering at least
+    `required_size` bytes.  Mappings are shared by every request in the
+    process and the file is only remapped once it has grown past the
+    current mapping (e.g. after a replenishment appended to it) or
+    replaced.  Whenever a file is (re)mapped, mappings of files that
+    have since been removed or replaced, e.g. by compaction in another
+    process, are evicted so their disk space can be freed.
+    '''
+    inode = os.stat(file_path).st_ino
+    with _mappings_lock:
+        mapping, mapped_inode = _mappings.get(file_path, (None, None))
+        if (mapping is None or mapped_inode != inode or
+                len(mapping) < required_size):
+            _evict_stale()
+            with open(file_path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                inode = os.fstat(f.fileno()).st_ino
+            # the previous mapping is released once any in-flight
+            # readers drop their views of it.
+            _mappings[file_path] = (mapping, inode)
+        return mapping
+
+
+def _evict_stale():
+    # dropping the last reference unmaps the file; a mapping that an
+    # in-flight reader still holds is unmapped once it is done.
+    for file_path, (mapping, inode) in list(_mappings.items()):
+        try:
+            if os.stat(file_path).st_ino == inode:
+                continue
+        except FileNotFoundError:
+            pass
+        del _mappings[file_path]
+
+
+def release_mapping(file_path):
+    '''
+    Drops the cached mapping for a file, e.g. before it is removed.
+    '''
+    with _mappings_lock:
+        _mappings.pop(file_path, None)
+
+
+def read_lines(file_path, first, size):
+    '''
+    Same as `list_based_flavorpack.storage.index.read_lines` but decodes
+    the block straight out of the shared mapping instead of reading it
+    into an intermediate buffer.
+    '''
+    if size < 1:
+        return []
+    start, end = index.get_byte_range(file_path, first, size)
+    with memoryview(get_mapping(file_path, end))[start:end] as block:
+        data = str(block, 'utf-8')
+    return index.split_lines(data, first)
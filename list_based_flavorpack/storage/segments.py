@@ -0,0 +1,143 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import json
+import os
+
+from list_based_flavorpack.storage import appender, index
+
+# Segmented regions keep a JSON manifest at the region's file path and
+# their numbers in indexed segment files next to it.  Segments that
+# have been fully consumed are dropped from the manifest and deleted, so
+# the segments listed are the ones still holding unissued numbers.
+
+
+def get_segment_path(file_path, name):
+    return os.path.join(os.path.dirname(file_path), name)
+
+
+def read_manifest(file_path):
+    '''
+    Returns the manifest stored at `file_path`.  An empty file (as
+    created by the ValidNumberDirectory rule) is an empty manifest.
+    '''
+    with open(file_path) as f:
+        data = f.read()
+    if not data:
+        return {'next_line': 1, 'next_sequence': 1, 'segments': []}
+    return json.loads(data)
+
+
+def write_manifest(file_path, manifest,
+                   fsync_policy=appender.DEFAULT_FSYNC_POLICY):
+    '''
+    Atomically replaces the manifest at `file_path`.
+    '''
+    temp_path = '%s.tmp' % file_path
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+        appender.sync(f, fsync_policy)
+    os.replace(temp_path, file_path)
+
+
+def append_segments(file_path, numbers, segment_size,
+                    fsync_policy=appender.DEFAULT_FSYNC_POLICY):
+    '''
+    Writes numbers into new segment files of at most `segment_size`
+    lines and then publishes them all with a single manifest update.
+    Each segment is written to a temp file and renamed into place.
+    The caller must hold the region's lock exclusively.
+    :return: The number of segments written.
+    '''
+    appender.check_fsync_policy(fsync_policy)
+    manifest = read_manifest(file_path)
+    base_name = os.path.basename(file_path)
+    written = 0
+    for start in range(0, len(numbers), segment_size):
+        chunk = numbers[start:start + segment_size]
+        name = '%s.%06d' % (base_name, manifest['next_sequence'])
+        path = get_segment_path(file_path, name)
+        appender.write_file(path, chunk, fsync_policy)
+        index.sync_index(path)
+        manifest['segments'].append({'name': name,
+                                     'first_line': manifest['next_line'],
+                                     'line_count': len(chunk)})
+        manifest['next_sequence'] += 1
+        manifest['next_line'] += len(chunk)
+        written += 1
+    write_manifest(file_path, manifest, fsync_policy)
+    return written
+
+
+def read_lines(file_path, manifest, first, size):
+    '''
+    Reads `size` numbers starting at line number `first`, opening only
+    the segments that hold them.
+    '''
+    if first + size > manifest['next_line']:
+        raise ValueError(
+            "There are not enough numbers available for this iteration "
+            "starting on line number: %s" % first)
+    lines = []
+    line = first
+    end = first + size
+    for segment in manifest['segments']:
+        segment_end = segment['first_line'] + segment['line_count']
+        if line >= end:
+            break
+        if line >= segment_end:
+            continue
+        count = min(end, segment_end) - line
+        lines += index.read_lines(
+            get_segment_path(file_path, segment['name']),
+            line - segment['first_line'] + 1, count)
+        line += count
+    if line < end:
+        raise ValueError(
+            "There are not enough numbers available for this iteration "
+            "starting on line number: %s" % line)
+    return lines
+
+
+def release_consumed(file_path, manifest, next_line):
+    '''
+    Deletes the segments that lie entirely before `next_line` and drops
+    them from the manifest.  The caller must hold the region's lock
+    exclusively.
+    :return: The number of segments released.
+    '''
+    consumed = [segment for segment in manifest['segments']
+                if segment['first_line'] + segment['line_count'] <= next_line]
+    if not consumed:
+        return 0
+    manifest['segments'] = manifest['segments'][len(consumed):]
+    write_manifest(file_path, manifest)
+    for segment in consumed:
+        path = get_segment_path(file_path, segment['name'])
+        for consumed_path in (path, index.get_index_path(path)):
+            if os.path.exists(consumed_path):
+                os.remove(consumed_path)
+    return len(consumed)
+
+
+def get_available_count(file_path, next_line):
+    '''
+    Returns the number of lines from `next_line` to the end of the last
+    segment.
+    '''
+    return read_manifest(file_path)['next_line'] - next_line
@@ -0,0 +1,311 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import atexit
+import itertools
+import os
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+
+from list_based_flavorpack import list_based_flavorpack_settings as settings
+
+# The pragmas a region may tune through its processing parameters, in
+# the order they are applied.  page_size must precede journal_mode since
+# a database in WAL mode can no longer change its page size.
+TUNING_PRAGMAS = ('page_size', 'journal_mode', 'synchronous', 'cache_size',
+                  'mmap_size', 'temp_store')
+PRAGMA_CHOICES = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY'),
+}
+
+# The number of rows inserted per transaction during ingest.
+DEFAULT_CHUNK_SIZE = 10000
+
+_local = threading.local()
+_caches = weakref.WeakValueDictionary()
+_caches_lock = threading.Lock()
+
+
+class _ConnectionCache(OrderedDict):
+    '''
+    A thread's connections, least recently used first.  The cache is
+    only referenced by its thread's locals, so it is freed, and its
+    connections closed, as soon as the thread exits.
+    '''
+
+    def close(self):
+        while self:
+            self.popitem()[1][0].close()
+
+    def __del__(self):
+        self.close()
+
+
+def _get_cache():
+    cache = getattr(_local, 'connections', None)
+    if cache is None:
+        cache = _local.connections = _ConnectionCache()
+        with _caches_lock:
+            _caches[id(cache)] = cache
+    return cache
+
+
+def _get_inode(db_file_path):
+    try:
+        return os.stat(db_file_path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def apply_pragmas(connection, pragmas):
+    # page_size and auto_vacuum only take effect on a new database if
+    # set before anything, journal_mode included, writes to it.
+    for name in sorted(pragmas, key=lambda name: name not in (
+            'page_size', 'auto_vacuum')):
+        connection.execute('PRAGMA %s = %s' % (name, pragmas[name]))
+
+
+def check_pragma(name, value):
+    '''
+    Validates a tuning pragma taken from a processing parameter and
+    returns its normalized value.  Raises a ValueError for unknown
+    pragmas or values.
+    '''
+    if name not in TUNING_PRAGMAS:
+        raise ValueError('%s is not a tunable SQLite pragma.' % name)
+    value = str(value).strip().upper()
+    if name in PRAGMA_CHOICES:
+        if value not in PRAGMA_CHOICES[name]:
+            raise ValueError('Invalid value %s for SQLite pragma %s; '
+                             'expected one of %s.' % (
+                                 value, name,
+                                 ', '.join(PRAGMA_CHOICES[name])))
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('SQLite pragma %s must be an integer, not %s.'
+                         % (name, value))
+
+
+def get_region_pragmas(region):
+    '''
+    Returns the tuning pragmas declared by a region's processing
+    parameters.  The `sqlite_profile` parameter names one of the
+    `SQLITE_PROFILES` setting's profiles and `sqlite_<pragma>` parameters
+    override single pragmas, e.g. `sqlite_synchronous` = `FULL`.
+    page_size only affects databases created with it.
+    '''
+    params = region.get_processing_parameters()
+    profile = params.get('sqlite_profile')
+    pragmas = {}
+    if profile:
+        try:
+            pragmas.update(settings.SQLITE_PROFILES[profile])
+        except KeyError:
+            raise ValueError('Unknown SQLite profile %s.' % profile)
+    for name in TUNING_PRAGMAS:
+        if 'sqlite_' + name in params:
+            pragmas[name] = params['sqlite_' + name]
+    return {name: check_pragma(name, value)
+            for name, value in pragmas.items()}
+
+
+def get_connection(db_file_path, pragmas=None, setup=None):
+    '''
+    Returns this thread's connection to a region database, opening it
+    and applying the `SQLITE_PRAGMAS` setting, overridden by `pragmas`,
+    on first use.  `setup`, if given, is called with each connection
+    when it is opened, e.g. to create the database's tables.  Each thread keeps at most `SQLITE_MAX_CONNECTIONS`
+    connections open, closing the least recently used one past that.
+    A connection is reopened if its database file was removed or
+    replaced or if it was opened with different pragmas.  Callers must
+    commit or roll back before returning; anything left open is rolled
+    back here.
+    '''
+    cache = _get_cache()
+    inode = _get_inode(db_file_path)
+    pragmas = dict(settings.SQLITE_PRAGMAS, **(pragmas or {}))
+    entry = cache.pop(db_file_path, None)
+    if entry and inode is not None and entry[1:] == (inode, pragmas):
+        connection = entry[0]
+        if connection.in_transaction:
+            connection.rollback()
+    else:
+        if entry:
+            entry[0].close()
+        connection = sqlite3.connect(db_file_path, check_same_thread=False)
+        apply_pragmas(connection, pragmas)
+        if setup:
+            setup(connection)
+        entry = (connection, _get_inode(db_file_path), pragmas)
+    cache[db_file_path] = entry
+    while len(cache) > settings.SQLITE_MAX_CONNECTIONS:
+        cache.popitem(last=False)[1][0].close()
+    return connection
+
+
+def get_region_connection(region, db_file_path=None):
+    '''
+    Returns this thread's connection to a region's database, or to one of
+    its shards if `db_file_path` is given, tuned with the region's
+    pragmas.
+    '''
+    return get_connection(db_file_path or region.db_file_path,
+                          get_region_pragmas(region))
+
+
+def get_shard_paths(region):
+    '''
+    Returns the database files holding a region's numbers: one per shard
+    if the region's `shard_count` processing parameter is greater than
+    one, otherwise just its db_file_path.
+    '''
+    shard_count = int(region.get_processing_parameter('shard_count', 1))
+    if shard_count <= 1:
+        return [region.db_file_path]
+    base, extension = os.path.splitext(region.db_file_path)
+    return ['%s_shard%d%s' % (base, shard, extension)
+            for shard in range(shard_count)]
+
+
+def begin_immediate(connection, wait=True):
+    '''
+    Starts a write transaction.  If `wait` is False and another
+    connection holds the database's write lock, returns False at once
+    instead of waiting for it.
+    '''
+    if wait:
+        connection.execute('BEGIN IMMEDIATE')
+        return True
+    busy_timeout = connection.execute('PRAGMA busy_timeout').fetchone()[0]
+    connection.execute('PRAGMA busy_timeout = 0')
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        return True
+    except sqlite3.OperationalError as e:
+        if 'locked' not in str(e):
+            raise
+        return False
+    finally:
+        connection.execute('PRAGMA busy_timeout = %d' % busy_timeout)
+
+
+def create_region_table(connection, table):
+    '''
+    Creates a region's number table along with its inventory counter,
+    a one-row table holding the number of unused rows that triggers
+    keep current in the same transaction as every insert, claim and
+    delete, and a partial index over the unused rows so claims find
+    them in rowid order however many used rows are kept.  Safe to run
+    against existing tables, for which the counter starts from a
+    one-time count of their unused rows.
+    '''
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.execute(
+            "create table if not exists %s "
+            "(serial_number text not null unique, used integer not null)"
+            % table)
+        connection.execute(
+            'create index if not exists {0}_UNUSED on {0} (used) '
+            'where used = 0'.format(table))
+        connection.execute(
+            'create table if not exists %s_INVENTORY '
+            '(available integer not null)' % table)
+        connection.execute(
+            'insert into {0}_INVENTORY (available) '
+            'select count(*) from {0} where used = 0 '
+            'and not exists (select 1 from {0}_INVENTORY)'.format(table))
+        connection.execute(
+            'create trigger if not exists {0}_INVENTORY_INSERT '
+            'after insert on {0} when new.used = 0 begin '
+            'update {0}_INVENTORY set available = available + 1; '
+            'end'.format(table))
+        connection.execute(
+            'create trigger if not exists {0}_INVENTORY_DELETE '
+            'after delete on {0} when old.used = 0 begin '
+            'update {0}_INVENTORY set available = available - 1; '
+            'end'.format(table))
+        connection.execute(
+            'create trigger if not exists {0}_INVENTORY_UPDATE '
+            'after update of used on {0} begin '
+            'update {0}_INVENTORY set available = available + '
+            '(new.used = 0) - (old.used = 0); '
+            'end'.format(table))
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+
+
+def get_inventory(connection, table):
+    '''
+    Returns the number of unused rows in a region's number table from
+    its inventory counter, creating the table and counter if needed.
+    '''
+    try:
+        return connection.execute(
+            'select available from %s_INVENTORY' % table).fetchone()[0]
+    except sqlite3.OperationalError:
+        create_region_table(connection, table)
+        return connection.execute(
+            'select available from %s_INVENTORY' % table).fetchone()[0]
+
+
+def insert_numbers(connection, table, numbers, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Inserts the numbers as unused rows, `chunk_size` rows per
+    `executemany` call, committing after each chunk so that allocations
+    can claim numbers between chunks.  Returns the number of rows
+    inserted.
+    '''
+    sql = 'insert into %s (serial_number, used) values (?, 0)' % table
+    numbers = iter(numbers)
+    count = 0
+    while True:
+        chunk = [(str(number),) for number in
+                 itertools.islice(numbers, chunk_size)]
+        if not chunk:
+            return count
+        with connection:
+            connection.executemany(sql, chunk)
+        count += len(chunk)
+
+
+def close_connection(db_file_path):
+    '''
+    Closes this thread's connection to a region database, if open.
+    '''
+    entry = _get_cache().pop(db_file_path, None)
+    if entry:
+        entry[0].close()
+
+
+@atexit.register
+def close_all():
+    '''
+    Closes every cached connection in every thread.  Runs at shutdown.
+    '''
+    with _caches_lock:
+        for cache in list(_caches.values()):
+            cache.close()
@@ -0,0 +1,87 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sqlite3
+
+# auto_vacuum values as reported by PRAGMA auto_vacuum.
+AUTO_VACUUM_INCREMENTAL = 2
+# VACUUM INTO was added in SQLite 3.27.
+SUPPORTS_VACUUM_INTO = sqlite3.sqlite_version_info >= (3, 27)
+
+
+def get_page_counts(connection):
+    '''
+    Returns the database's total and free page counts.
+    '''
+    return (connection.execute('PRAGMA page_count').fetchone()[0],
+            connection.execute('PRAGMA freelist_count').fetchone()[0])
+
+
+def uses_incremental_vacuum(connection):
+    return connection.execute(
+        'PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+
+
+def reclaim_pages(connection, max_pages):
+    '''
+    Returns up to `max_pages` free pages to the file system.  Requires
+    incremental auto_vacuum; does nothing otherwise.  Returns the number
+    of pages reclaimed.
+    '''
+    if max_pages <= 0 or not uses_incremental_vacuum(connection):
+        return 0
+    before = get_page_counts(connection)[1]
+    # executescript steps the pragma to completion; execute() would only
+    # free the first page.
+    connection.executescript('PRAGMA incremental_vacuum(%d)' % int(max_pages))
+    return before - get_page_counts(connection)[1]
+
+
+def vacuum_into(connection, db_file_path):
+    '''
+    Rebuilds the database into a temporary file next to it with VACUUM
+    INTO, switching it to incremental auto_vacuum on the way, and copies
+    the result back over the live database with the backup API.  Copying
+    back rather than renaming keeps the file, its WAL and every open
+    connection valid.  Older SQLite versions without VACUUM INTO run a
+    plain VACUUM in place instead.  Callers must keep writers out for the
+    duration.  Returns the number of pages reclaimed.
+    '''
+    before = get_page_counts(connection)[0]
+    if not SUPPORTS_VACUUM_INTO:
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.execute('VACUUM')
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return before - get_page_counts(connection)[0]
+    temp_path = '%s.vacuum' % db_file_path
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.execute('VACUUM INTO ?', (temp_path,))
+        vacuumed = sqlite3.connect(temp_path)
+        try:
+            vacuumed.backup(connection)
+        finally:
+            vacuumed.close()
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return before - get_page_counts(connection)[0]
@@ -0,0 +1,95 @@
+'''
+    Copyright 2021 SerialLab, CORP
+
+    This file is part of ListBasedFlavorpack.
+
+    ListBasedFlavorpack is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ListBasedFlavorpack is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ListBasedFlavorpack.  If not, see <http://www.gnu.org/licenses/>.
+
+    Chooses which of a pool's list-based regions serves a request that
+    does not name one, according to the pool's PoolAllocationStrategy.
+'''
+import itertools
+import logging
+import threading
+
+from rest_framework.exceptions import NotFound
+
+from list_based_flavorpack import prefetch
+from list_based_flavorpack.models import ListBasedRegion, \
+    PoolAllocationStrategy
+from list_based_flavorpack.processing_classes.third_party_processing.rules \
+    import SufficientNumbersStorage
+
+logger = logging.getLogger(__name__)
+
+_counters = {}
+_lock = threading.Lock()
+
+
+def get_strategy(pool):
+    '''
+    Returns the pool's allocation strategy, first if it has none.
+    '''
+    try:
+        return pool.list_based_strategy.strategy
+    except PoolAllocationStrategy.DoesNotExist:
+        return PoolAllocationStrategy.FIRST
+
+
+def get_available_count(region, processing_class):
+    '''
+    Returns how many numbers the region can issue without being
+    replenished, as counted by the SufficientNumbersStorage rule among
+    its processing class's pre-processing rules.  Regions without such
+    a rule, like those that generate their numbers, are unbounded and
+    regions whose inventory can't be counted are reported as empty.
+    '''
+    for rule in processing_class().get_pre_processing_rules():
+        if issubclass(rule, SufficientNumbersStorage):
+            try:
+                return rule().get_available_count(region) + \
+                       prefetch.get_buffered_count(region)
+            except Exception:
+                logger.warning('Could not count the inventory of region '
+                               '%s.', region.machine_name, exc_info=True)
+                return 0
+    return float('inf')
+
+
+def rank_regions(pool, size, strategy, import_processing_class):
+    '''
+    Returns the pool's active list-based regions with their available
+    counts in the order the strategy would allocate from them.  Regions
+    that can fill `size` from their inventory always come before those
+    that would have to be replenished.
+    :param import_processing_class: Returns a region's processing class.
+    '''
+    regions = list(ListBasedRegion.objects.select_related(
+        'pool').prefetch_related('processing_parameters').filter(
+        pool=pool, active=True).order_by('order'))
+    if not regions:
+        raise NotFound(
+            "SerialBox could not find any active list-based regions for "
+            "the pool with machine name %s." % pool.machine_name)
+    ranked = [(region, get_available_count(
+        region, import_processing_class(region))) for region in regions]
+    if strategy == PoolAllocationStrategy.ROUND_ROBIN:
+        with _lock:
+            counter = _counters.setdefault(pool.pk, itertools.count())
+            start = next(counter) % len(ranked)
+        ranked = ranked[start:] + ranked[:start]
+    elif strategy == PoolAllocationStrategy.MOST_INVENTORY:
+        ranked.sort(key=lambda item: -item[1])
+    ranked.sort(key=lambda item: item[1] < size)
+    return ranked
@@ -13,9 +13,14 @@
 #
 # Copyright 2019 SerialLab Corp.  All rights reserved.
 import calendar
+import os
 import time
+from django.db import transaction
 from serialbox import models as sb_models
-from list_based_flavorpack import models as lb_models
+from list_based_flavorpack import cursor, models as lb_models
+from list_based_flavorpack.storage import blocks, compaction, index, \
+    mapping, sqlite, vacuum
+from list_based_flavorpack.storage.locks import lock_file
 from copy import deepcopy
 from uuid import uuid1
 
@@ -58,4 +63,115 @@ def clone_list_based_pool(pool_machine_name, new_pool_machine_name):
         new_param.list_based_region = new_region
         if param.value == pool_machine_name:
             new_param.value = new_pool_machine_name
-        new_param.save()
\ No newline at end of file
+        new_param.save()
+
+
+def compact_list_based_region(region, archive=True):
+    """
+    Rewrites the unconsumed tail of a flat-file region into a new file,
+    swaps the region over to it and resets its last number line.  The
+    consumed lines are optionally gzipped next to the old file as
+    <file_id>.consumed.gz.  Holds the region's lock exclusively so
+    allocations and ingest steps wait for the swap to finish.
+    :param region: The ListBasedRegion to compact.
+    :param archive: Whether or not to archive the consumed lines.
+    :return: The number of consumed lines removed.
+    """
+    with lock_file(region.lock_file_path):
+        new_file_id = uuid1()
+        new_file_path = os.path.join(region.directory_path, str(new_file_id))
+        try:
+            with transaction.atomic():
+                region = lb_models.ListBasedRegion.objects.select_for_update(
+                ).get(pk=region.pk)
+                old_file_path = region.file_path
+                removed = compaction.compact_file(
+                    old_file_path, new_file_path, region.last_number_line,
+                    '%s.consumed.gz' % old_file_path if archive else None)
+                lb_models.ListBasedRegion.objects.filter(pk=region.pk).update(
+                    file_id=new_file_id, last_number_line=1)
+                cursor.reset_journal(region)
+        except Exception:
+            for path in (new_file_path, index.get_index_path(new_file_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        mapping.release_mapping(old_file_path)
+        os.remove(old_file_path)
+        os.remove(index.get_index_path(old_file_path))
+    return removed
+
+
+def convert_list_based_region(region, block_size=blocks.DEFAULT_BLOCK_SIZE,
+                              codec='zlib'):
+    """
+    Converts a flat-file region to block-compressed storage and switches
+    it to the CompressedProcessingClass.  Line numbers are kept so the
+    region's last number line is still valid.  The region's rule must
+    be switched to a step that writes compressed blocks
+    (e.g. CompressedUUIDRequestStep) separately.
+    :param region: The ListBasedRegion to convert.
+    :param block_size: The number of lines per compressed block.
+    :param codec: zlib or lzma.
+    :return: The number of lines converted.
+    """
+    with lock_file(region.lock_file_path):
+        region.refresh_from_db()
+        old_file_path = region.file_path
+        region.file_id = uuid1()
+        try:
+            converted = blocks.convert_file(old_file_path, region.file_path,
+                                            block_size, codec)
+            region.processing_class_path = (
+                'list_based_flavorpack.processing_classes.'
+                'third_party_processing.processing.CompressedProcessingClass')
+            region.save(update_fields=['file_id', 'processing_class_path'])
+        except Exception:
+            for path in (region.file_path,
+                         blocks.get_block_index_path(region.file_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        mapping.release_mapping(old_file_path)
+        for path in (old_file_path, index.get_index_path(old_file_path)):
+            if os.path.exists(path):
+                os.remove(path)
+    return converted
+
+
+def vacuum_db_region(region, max_pages=None, full=False):
+    """
+    Reclaims the free pages left in a DB region's database by claimed
+    numbers.  By default up to `max_pages` free pages are returned to the
+    file system with an incremental vacuum, which allocations can
+    interleave with.  A full vacuum rebuilds the whole database with
+    VACUUM INTO (plain VACUUM before SQLite 3.27), switching it to
+    incremental auto_vacuum, and holds the
+    region's lock exclusively while doing so; run it in quiet windows.
+    Each shard of a sharded region is vacuumed in turn.
+    :param region: The DB ListBasedRegion to vacuum.
+    :param max_pages: The most pages an incremental vacuum may reclaim
+    from each database.
+    All free pages are reclaimed if None.
+    :param full: Whether or not to run a full vacuum.
+    :return: A dictionary with the reclaimed_pages, the page_count and
+    free_pages left and the seconds spent.
+    """
+    start = time.time()
+    metrics = {'reclaimed_pages': 0, 'page_count': 0, 'free_pages': 0}
+    for path in sqlite.get_shard_paths(region):
+        connection = sqlite.get_region_connection(region, path)
+        if full:
+            with lock_file(region.lock_file_path):
+                reclaimed = vacuum.vacuum_into(connection, path)
+        else:
+            reclaimed = vacuum.reclaim_pages(
+                connection,
+                max_pages if max_pages is not None else
+                vacuum.get_page_counts(connection)[1])
+        page_count, free_pages = vacuum.get_page_counts(connection)
+        metrics['reclaimed_pages'] += reclaimed
+        metrics['page_count'] += page_count
+        metrics['free_pages'] += free_pages
+    metrics['seconds'] = time.time() - start
+    return metrics
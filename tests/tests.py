@@ -1,19 +1,48 @@
+import gzip
 import linecache
 import os
 import sqlite3
+import threading
+import time
+import uuid
+from unittest import mock
 
+from django.core.management import call_command
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.contrib.auth.models import User
+from rest_framework.test import APIRequestFactory, force_authenticate
 
 from list_based_flavorpack.processing_classes import get_region_db_number_count
-from list_based_flavorpack.processing_classes.third_party_processing.rules import get_region_table
+from list_based_flavorpack.processing_classes.third_party_processing.processing import \
+    DBProcessingClass, ShardedDBProcessingClass, ORMProcessingClass, \
+    ThirdPartyProcessingClass
+from list_based_flavorpack.processing_classes.vanilla_processing.processing \
+    import VanillaProcessingClass
+from list_based_flavorpack.processing_classes.third_party_processing.rules import get_region_table, \
+    SufficientNumbersStorage, ReclaimFreePages, SufficientShardedDBNumbers, \
+    SufficientDBNumbers, ValidNumberDirectory, SufficientCompressedNumbers, \
+    SufficientSegmentedNumbers, CompactConsumedNumbers, \
+    InsufficientNumbersError
 
-from list_based_flavorpack.models import ListBasedRegion
-from quartet_capture.models import Rule, Step
+from list_based_flavorpack import cursor, prefetch, replenishment, batch, \
+    strategies
+from list_based_flavorpack.api.views import BatchAllocateView
+from list_based_flavorpack.models import ListBasedRegion, ProcessingParameters, \
+    ListBasedNumber, PoolAllocationStrategy
+from list_based_flavorpack.utils import compact_list_based_region, \
+    convert_list_based_region, vacuum_db_region
+from list_based_flavorpack.storage import index, mapping, fixed_width, \
+    segments, blocks, appender, sqlite, archive, vacuum
+from list_based_flavorpack.storage.locks import try_lock_file
+from list_based_flavorpack.steps import UUIDRequestStep, \
+    CompressedUUIDRequestStep, ShardedUUIDRequestDBStep, ORMUUIDRequestStep
+from quartet_capture.models import Rule, Step, StepParameter
 from quartet_templates.models import Template
 from serialbox import models as sb_models
 from serialbox.api import serializers as sb_serializers
 from serialbox.discovery import get_generator
+from serialbox.rules.errors import RuleError
 
 
 class TemplateTest(TestCase):
@@ -97,6 +126,274 @@ class ListBasedRegionTest(TestCase):
                          list_based_region.file_path)
 
 
+class OffsetIndexTest(TestCase):
+    '''
+    Tests the byte-offset index kept next to flat number files.
+    '''
+
+    def setUp(self):
+        self.file_path = '/tmp/offset_index_test'
+        with open(self.file_path, 'w') as f:
+            f.writelines('%s\n' % i for i in range(1, 101))
+
+    def tearDown(self):
+        for path in (self.file_path, index.get_index_path(self.file_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_read_lines(self):
+        self.assertEqual(['10', '11', '12'],
+                         index.read_lines(self.file_path, 10, 3))
+        self.assertEqual(100, index.get_line_count(self.file_path))
+
+    def test_append_and_partial_line(self):
+        index.sync_index(self.file_path)
+        with open(self.file_path, 'a') as f:
+            f.write('101\n102')
+        self.assertEqual(101, index.sync_index(self.file_path))
+        self.assertEqual(['100', '101'],
+                         index.read_lines(self.file_path, 100, 2))
+        with self.assertRaises(ValueError):
+            index.read_lines(self.file_path, 101, 2)
+
+    def test_append_cuts_partial_line(self):
+        with open(self.file_path, 'a') as f:
+            f.write('10')
+        self.assertEqual(2, appender.append_lines(self.file_path,
+                                                  ['101', '102'],
+                                                  buffer_lines=1))
+        self.assertEqual(['100', '101', '102'],
+                         index.read_lines(self.file_path, 100, 3))
+        with open(self.file_path, 'a') as f:
+            f.write('10')
+        size = os.path.getsize(self.file_path)
+        with self.assertRaises(ValueError):
+            appender.append_lines(self.file_path, ['103'], 'sometimes')
+        # a bad policy leaves the file alone.
+        self.assertEqual(size, os.path.getsize(self.file_path))
+
+    def test_mapped_read_remaps_on_growth(self):
+        self.assertEqual(['1', '2'], mapping.read_lines(self.file_path, 1, 2))
+        with open(self.file_path, 'a') as f:
+            f.write('101\n')
+        self.assertEqual(['100', '101'],
+                         mapping.read_lines(self.file_path, 100, 2))
+        mapping.release_mapping(self.file_path)
+
+    def test_removed_file_mapping_is_evicted(self):
+        mapping.read_lines(self.file_path, 1, 2)
+        # e.g. compacted away by another process.
+        os.remove(self.file_path)
+        other_path = '%s_other' % self.file_path
+        with open(other_path, 'w') as f:
+            f.write('1\n')
+        self.addCleanup(os.remove, other_path)
+        self.addCleanup(os.remove, index.get_index_path(other_path))
+        self.addCleanup(mapping.release_mapping, other_path)
+        self.assertEqual(['1'], mapping.read_lines(other_path, 1, 1))
+        self.assertNotIn(self.file_path, mapping._mappings)
+
+
+class FixedWidthTest(TestCase):
+    '''
+    Tests the fixed-width record file format.
+    '''
+
+    def setUp(self):
+        self.file_path = '/tmp/fixed_width_test'
+        open(self.file_path, 'w').close()
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_append_and_read(self):
+        self.assertEqual(0, fixed_width.get_record_count(self.file_path))
+        fixed_width.append_records(self.file_path, ['AAA1', 'AAA2', 'AAA3'])
+        fixed_width.append_records(self.file_path, ['AAA4'])
+        self.assertEqual(4, fixed_width.get_record_count(self.file_path))
+        self.assertEqual(['AAA2', 'AAA3', 'AAA4'],
+                         fixed_width.read_records(self.file_path, 2, 3))
+        with self.assertRaises(ValueError):
+            fixed_width.read_records(self.file_path, 3, 3)
+
+    def test_partial_record_is_ignored(self):
+        fixed_width.append_records(self.file_path, ['AAA1', 'AAA2'])
+        with open(self.file_path, 'ab') as f:
+            f.write(b'AA')
+        self.assertEqual(2, fixed_width.get_record_count(self.file_path))
+        fixed_width.append_records(self.file_path, ['AAA3'])
+        self.assertEqual(['AAA2', 'AAA3'],
+                         fixed_width.read_records(self.file_path, 2, 2))
+
+    def test_padding_and_width(self):
+        fixed_width.append_records(self.file_path, ['AAA1', 'AAA2'])
+        fixed_width.append_records(self.file_path, ['B3'])
+        self.assertEqual(['AAA2', 'B3'],
+                         fixed_width.read_records(self.file_path, 2, 2))
+        open(self.file_path, 'w').close()
+        fixed_width.append_records(self.file_path, ['AAA1', 'B2'])
+        self.assertEqual(['AAA1', 'B2'],
+                         fixed_width.read_records(self.file_path, 1, 2))
+        with self.assertRaises(ValueError):
+            fixed_width.append_records(self.file_path, ['CCCC5'])
+
+
+class CompressedBlocksTest(TestCase):
+    '''
+    Tests the block-compressed number file format.
+    '''
+
+    def setUp(self):
+        self.file_path = '/tmp/compressed_blocks_test'
+        open(self.file_path, 'w').close()
+        self.numbers = [str(i) for i in range(1, 251)]
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        os.remove(blocks.get_block_index_path(self.file_path))
+
+    def test_read_across_blocks(self):
+        blocks.append_blocks(self.file_path, self.numbers[:120], 50)
+        blocks.append_blocks(self.file_path, self.numbers[120:], 50, 'lzma')
+        self.assertEqual(250, blocks.get_line_count(self.file_path))
+        self.assertEqual(self.numbers[44:166],
+                         blocks.read_lines(self.file_path, 45, 122))
+        with self.assertRaises(ValueError):
+            blocks.read_lines(self.file_path, 200, 52)
+
+    def test_convert_file(self):
+        source_path = '/tmp/compressed_blocks_source'
+        with open(source_path, 'w') as f:
+            f.writelines('%s\n' % number for number in self.numbers)
+        self.assertEqual(250, blocks.convert_file(source_path,
+                                                  self.file_path, 64))
+        os.remove(source_path)
+        self.assertEqual(self.numbers[60:70],
+                         blocks.read_lines(self.file_path, 61, 10))
+
+
+class SQLiteConnectionTest(TestCase):
+    '''
+    Tests the per-thread region database connection cache.
+    '''
+
+    def setUp(self):
+        self.paths = ['/tmp/connection_test_%s.db' % i for i in range(3)]
+
+    def tearDown(self):
+        for path in self.paths:
+            sqlite.close_connection(path)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def test_reuse_and_reopen(self):
+        connection = sqlite.get_connection(self.paths[0])
+        self.assertEqual('wal', connection.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+        self.assertIs(connection, sqlite.get_connection(self.paths[0]))
+        connection.execute('create table t (a integer)')
+        for suffix in ('', '-wal', '-shm'):
+            os.remove(self.paths[0] + suffix)
+        reopened = sqlite.get_connection(self.paths[0])
+        self.assertIsNot(connection, reopened)
+        self.assertEqual([], reopened.execute(
+            'SELECT name FROM sqlite_master').fetchall())
+
+    def test_lru_eviction(self):
+        with mock.patch.object(sqlite.settings, 'SQLITE_MAX_CONNECTIONS', 2):
+            first = sqlite.get_connection(self.paths[0])
+            sqlite.get_connection(self.paths[1])
+            sqlite.get_connection(self.paths[2])
+            self.assertIsNot(first, sqlite.get_connection(self.paths[0]))
+
+    def test_thread_exit_closes_connections(self):
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(
+            sqlite.get_connection(self.paths[0])))
+        thread.start()
+        thread.join()
+        del thread
+        self.assertEqual(1, len(connections))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute('select 1')
+        self.assertFalse(any(self.paths[0] in cache
+                             for cache in list(sqlite._caches.values())))
+
+    def test_chunked_insert(self):
+        connection = sqlite.get_connection(self.paths[0])
+        connection.execute('create table t (serial_number text not null '
+                           'unique, used integer not null)')
+        other = sqlite3.connect(self.paths[0])
+        seen = []
+
+        def numbers():
+            for i in range(10):
+                # rows from earlier chunks are visible to other readers
+                seen.append(other.execute(
+                    'select count(*) from t').fetchone()[0])
+                yield i
+
+        self.assertEqual(10, sqlite.insert_numbers(connection, 't',
+                                                   numbers(), 4))
+        other.close()
+        self.assertEqual([0, 0, 0, 0, 4, 4, 4, 4, 8, 8], seen)
+        self.assertEqual(10, connection.execute(
+            'select count(*) from t where used = 0').fetchone()[0])
+
+    def test_inventory_counter(self):
+        connection = sqlite.get_connection(self.paths[0])
+        # a table from before the counter existed
+        connection.execute('create table t (serial_number text not null '
+                           'unique, used integer not null)')
+        sqlite.insert_numbers(connection, 't', range(5))
+        self.assertEqual(5, sqlite.get_inventory(connection, 't'))
+        sqlite.insert_numbers(connection, 't', range(5, 8))
+        with connection:
+            connection.execute('delete from t where rowid <= 2')
+            connection.execute('update t set used = 1 where rowid = 3')
+        self.assertEqual(5, sqlite.get_inventory(connection, 't'))
+        with connection:
+            connection.execute('delete from t where rowid = 3')
+        self.assertEqual(5, sqlite.get_inventory(connection, 't'))
+        self.assertEqual(5, connection.execute(
+            'select count(*) from t where used = 0').fetchone()[0])
+
+
+class SegmentsTest(TestCase):
+    '''
+    Tests the segmented storage layout.
+    '''
+
+    def setUp(self):
+        self.file_path = '/tmp/segments_test'
+        open(self.file_path, 'w').close()
+
+    def tearDown(self):
+        for segment in segments.read_manifest(self.file_path)['segments']:
+            path = segments.get_segment_path(self.file_path, segment['name'])
+            os.remove(path)
+            os.remove(index.get_index_path(path))
+        os.remove(self.file_path)
+
+    def test_segments(self):
+        numbers = [str(i) for i in range(1, 26)]
+        self.assertEqual(3, segments.append_segments(self.file_path, numbers,
+                                                     10))
+        self.assertEqual(16, segments.get_available_count(self.file_path, 10))
+        manifest = segments.read_manifest(self.file_path)
+        self.assertEqual(numbers[8:22],
+                         segments.read_lines(self.file_path, manifest, 9, 14))
+        with self.assertRaises(ValueError):
+            segments.read_lines(self.file_path, manifest, 20, 7)
+        self.assertEqual(2, segments.release_consumed(self.file_path,
+                                                      manifest, 22))
+        manifest = segments.read_manifest(self.file_path)
+        self.assertEqual(1, len(manifest['segments']))
+        self.assertEqual(['22', '23'],
+                         segments.read_lines(self.file_path, manifest, 22, 2))
+
+
 class UUIDPoolTest(TestCase):
     '''
     Tests the Third Party Processing Class along with the UUID generation step.
@@ -110,11 +407,13 @@ class UUIDPoolTest(TestCase):
                                                       self.rule, self.template)
 
     def tearDown(self):
-        try:
-            os.remove(self.list_based_region.file_path)
-        except:
-            # some tests don't use filesystem.
-            pass
+        for path in (self.list_based_region.file_path,
+                     index.get_index_path(self.list_based_region.file_path)):
+            try:
+                os.remove(path)
+            except:
+                # some tests don't use filesystem.
+                pass
 
     def generate_test_pool(self):
         # create pool
@@ -195,6 +494,319 @@ class UUIDPoolTest(TestCase):
         file_size = sum((1 for i in open(self.list_based_region.file_path)))
         self.assertEqual(200, file_size)
 
+    def test_available_count_from_index(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        self.list_based_region.refresh_from_db()
+        self.assertEqual(200, index.get_line_count(
+            self.list_based_region.file_path))
+        self.assertEqual(195, SufficientNumbersStorage().get_available_count(
+            self.list_based_region))
+
+    def test_ingest_without_number_file(self):
+        file_path = self.list_based_region.file_path
+        self.assertFalse(os.path.exists(file_path))
+        UUIDRequestStep(None).persist_data(self.list_based_region, 10)
+        self.assertEqual(10, index.get_line_count(file_path))
+        for path in (file_path, index.get_index_path(file_path)):
+            os.remove(path)
+        self.addCleanup(os.remove, blocks.get_block_index_path(file_path))
+        CompressedUUIDRequestStep(None).persist_data(
+            self.list_based_region, 10)
+        self.assertEqual(10, blocks.get_line_count(file_path))
+
+    def test_declared_parameters(self):
+        self.assertIn('buffer-size', UUIDRequestStep(None).declared_parameters)
+        self.assertIn('fsync-policy',
+                      CompressedUUIDRequestStep(None).declared_parameters)
+        self.assertNotIn('buffer-size',
+                         CompressedUUIDRequestStep(None).declared_parameters)
+        for step_class in (ShardedUUIDRequestDBStep, ORMUUIDRequestStep):
+            self.assertFalse({'fsync-policy', 'buffer-size'} & set(
+                step_class(None).declared_parameters))
+
+    def test_compaction(self):
+        first = self.generate_allocation(5, self.test_pool,
+                                         self.list_based_region).number_list
+        old_file_path = self.list_based_region.file_path
+        with open(old_file_path) as f:
+            remaining = [line.strip() for line in f.readlines()[5:]]
+        self.assertEqual(5, compact_list_based_region(self.list_based_region))
+        self.list_based_region.refresh_from_db()
+        self.assertEqual(1, self.list_based_region.last_number_line)
+        self.assertFalse(os.path.exists(old_file_path))
+        with gzip.open('%s.consumed.gz' % old_file_path, 'rt') as f:
+            self.assertEqual(first, [line.strip() for line in f])
+        os.remove('%s.consumed.gz' % old_file_path)
+        response = self.generate_allocation(10, self.test_pool,
+                                            self.list_based_region)
+        self.assertEqual(remaining[:10], response.number_list)
+
+    def test_unreadable_block_index(self):
+        index_path = blocks.get_block_index_path(
+            self.list_based_region.file_path)
+        os.mkdir(index_path)
+        self.addCleanup(os.rmdir, index_path)
+        with self.assertRaises(RuleError):
+            SufficientCompressedNumbers().get_available_count(
+                self.list_based_region)
+
+    def test_stale_region_after_compaction(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        stale = ListBasedRegion.objects.get(pk=self.list_based_region.pk)
+        old_file_path = stale.file_path
+        compact_list_based_region(self.list_based_region, archive=False)
+        ValidNumberDirectory().execute(None, None, stale, 5)
+        self.assertEqual(195,
+                         SufficientNumbersStorage().get_available_count(stale))
+        self.assertFalse(os.path.exists(old_file_path))
+        self.assertFalse(os.path.exists(index.get_index_path(old_file_path)))
+
+    def test_missing_file_is_recreated(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        self.list_based_region.refresh_from_db()
+        os.remove(self.list_based_region.file_path)
+        ValidNumberDirectory().execute(None, None, self.list_based_region, 5)
+        self.assertTrue(os.path.exists(self.list_based_region.file_path))
+
+    def test_failed_post_processing_rule_keeps_numbers(self):
+        with mock.patch.object(CompactConsumedNumbers, 'execute',
+                               side_effect=OSError):
+            response = self.generate_allocation(5, self.test_pool,
+                                                self.list_based_region)
+        self.assertEqual(index.read_lines(self.list_based_region.file_path,
+                                          1, 5), response.number_list)
+
+    def test_automatic_compaction(self):
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='compaction_ratio', value='0.5')
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='compaction_archive', value='false')
+        old_file_path = self.list_based_region.file_path
+        with mock.patch.object(replenishment, 'run_in_background',
+                               side_effect=lambda key, function, *args:
+                               function(*args)) as queue:
+            self.generate_allocation(50, self.test_pool,
+                                     self.list_based_region)
+            self.assertTrue(os.path.exists(old_file_path))
+            self.generate_allocation(50, self.test_pool,
+                                     self.list_based_region)
+            self.assertEqual(('compact', self.list_based_region.pk),
+                             queue.call_args[0][0])
+        self.assertFalse(os.path.exists(old_file_path))
+        self.list_based_region.refresh_from_db()
+        self.assertEqual(100, index.get_line_count(
+            self.list_based_region.file_path))
+
+    def test_segmented_region(self):
+        self.list_based_region.processing_class_path = (
+            'list_based_flavorpack.processing_classes.third_party_processing.'
+            'processing.SegmentedProcessingClass')
+        self.list_based_region.save()
+        step = Step.objects.get(rule=self.rule)
+        step.step_class = 'list_based_flavorpack.steps.SegmentedUUIDRequestStep'
+        step.save()
+        StepParameter.objects.create(step=step, name='segment-size',
+                                     value='50')
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='cursor_mode', value='journal')
+
+        try:
+            first = self.generate_allocation(
+                5, self.test_pool, self.list_based_region).number_list
+            self.assertTrue(os.path.exists(
+                cursor.get_journal_path(self.list_based_region)))
+            manifest = segments.read_manifest(
+                self.list_based_region.file_path)
+            self.assertEqual(4, len(manifest['segments']))
+            self.assertEqual(segments.read_lines(
+                self.list_based_region.file_path, manifest, 1, 5), first)
+            second = self.generate_allocation(
+                50, self.test_pool, self.list_based_region).number_list
+            self.assertEqual(55, len(set(first + second)))
+            # the fully consumed first segment was deleted.
+            manifest = segments.read_manifest(
+                self.list_based_region.file_path)
+            self.assertEqual(3, len(manifest['segments']))
+            self.list_based_region.refresh_from_db()
+            self.assertEqual(
+                145, SufficientSegmentedNumbers().get_available_count(
+                    self.list_based_region))
+        finally:
+            cursor.reset_journal(self.list_based_region)
+            for segment in segments.read_manifest(
+                    self.list_based_region.file_path)['segments']:
+                path = segments.get_segment_path(
+                    self.list_based_region.file_path, segment['name'])
+                os.remove(path)
+                os.remove(index.get_index_path(path))
+
+    def test_convert_to_compressed(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        with open(self.list_based_region.file_path) as f:
+            remaining = [line.strip() for line in f.readlines()[5:]]
+        self.assertEqual(200, convert_list_based_region(
+            self.list_based_region))
+        response = self.generate_allocation(10, self.test_pool,
+                                            self.list_based_region)
+        self.assertEqual(remaining[:10], response.number_list)
+        self.list_based_region.refresh_from_db()
+        os.remove(blocks.get_block_index_path(
+            self.list_based_region.file_path))
+
+    def test_failed_read_releases_reservation(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        processing_class = ThirdPartyProcessingClass()
+        with mock.patch.object(ThirdPartyProcessingClass, 'read_lines',
+                               side_effect=OSError):
+            with self.assertRaises(OSError):
+                processing_class.get_items(self.list_based_region, 10)
+        self.list_based_region.refresh_from_db()
+        self.assertEqual(6, self.list_based_region.last_number_line)
+        self.assertEqual(
+            index.read_lines(self.list_based_region.file_path, 6, 10),
+            processing_class.get_items(self.list_based_region, 10))
+        self.assertEqual(16, self.list_based_region.last_number_line)
+
+    def test_reservation_never_passes_end_of_file(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        for cursor_mode in ('atomic', 'journal'):
+            ProcessingParameters.objects.update_or_create(
+                list_based_region=self.list_based_region, key='cursor_mode',
+                defaults={'value': cursor_mode})
+            self.list_based_region.refresh_from_db()
+            with self.assertRaises(InsufficientNumbersError):
+                ThirdPartyProcessingClass().get_items(
+                    self.list_based_region, 196)
+            self.list_based_region.refresh_from_db()
+            self.assertEqual(6, self.list_based_region.last_number_line)
+        cursor.reset_journal(self.list_based_region)
+        self.assertEqual(
+            index.read_lines(self.list_based_region.file_path, 6, 195),
+            ThirdPartyProcessingClass().get_items(self.list_based_region,
+                                                  195))
+
+    def test_consumption_archive(self):
+        archive_path = self.list_based_region.archive_file_path
+
+        def remove_archive():
+            sqlite.close_connection(archive_path)
+            for path in (archive_path, archive_path + '-wal',
+                         archive_path + '-shm',
+                         archive.get_log_path(archive_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+        remove_archive()
+        self.addCleanup(remove_archive)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='consumption_archive', value='true')
+        with mock.patch.object(replenishment, 'run_in_background') as queue:
+            first = self.generate_allocation(
+                5, self.test_pool, self.list_based_region).number_list
+            second = self.generate_allocation(
+                3, self.test_pool, self.list_based_region).number_list
+        self.assertEqual(('archive', self.list_based_region.pk),
+                         queue.call_args[0][0])
+        self.assertFalse(os.path.exists(archive_path))
+        self.assertEqual(2, archive.flush(archive_path))
+        found = archive.find_allocation(archive_path, first[4])
+        self.assertEqual(self.list_based_region.machine_name,
+                         found['region'])
+        self.assertEqual(5, found['size'])
+        self.assertEqual(found, archive.find_allocation(archive_path,
+                                                        first[0]))
+        self.assertEqual(3, archive.find_allocation(archive_path,
+                                                    second[0])['size'])
+        self.assertNotEqual(found['allocation_id'], archive.find_allocation(
+            archive_path, second[0])['allocation_id'])
+        self.assertIsNone(archive.find_allocation(archive_path, 'missing'))
+        # a log flushed again after a crash is not archived twice, and
+        # find_allocation flushes the log first.
+        archive.record(archive_path, found['allocation_id'], 'REGION',
+                       found['issued'], first)
+        archive.record(archive_path, 'third', 'REGION', 0, ['X'])
+        self.assertEqual('third',
+                         archive.find_allocation(archive_path,
+                                                 'X')['allocation_id'])
+        self.assertEqual(found, archive.find_allocation(archive_path,
+                                                        first[0]))
+
+    def test_archive_failure_keeps_numbers(self):
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='consumption_archive', value='true')
+        with mock.patch.object(archive, 'get_log_path',
+                               return_value='/missing/archive.log'):
+            response = self.generate_allocation(5, self.test_pool,
+                                                self.list_based_region)
+        self.assertEqual(index.read_lines(self.list_based_region.file_path,
+                                          1, 5), response.number_list)
+
+    def test_processing_parameters_cached(self):
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='prefetch_size', value='10')
+        region = ListBasedRegion.objects.get(pk=self.list_based_region.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(10, prefetch.get_prefetch_size(region))
+            self.assertFalse(cursor.uses_journal(region))
+            self.assertEqual(0, replenishment.get_low_watermark(region))
+        ProcessingParameters.objects.filter(key='prefetch_size').update(
+            value='20')
+        region.refresh_from_db()
+        self.assertEqual(20, prefetch.get_prefetch_size(region))
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='prefetch_size', value='30')
+        region.refresh_from_db()
+        self.assertEqual(30, prefetch.get_prefetch_size(region))
+
+    def test_journal_cursor_mode(self):
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='cursor_mode', value='journal')
+        numbers = self.generate_allocation(5, self.test_pool,
+                                           self.list_based_region).number_list
+        numbers += self.generate_allocation(10, self.test_pool,
+                                            self.list_based_region).number_list
+        self.list_based_region.refresh_from_db()
+        self.assertEqual(16, self.list_based_region.last_number_line)
+        self.assertEqual(numbers, index.read_lines(
+            self.list_based_region.file_path, 1, 15))
+        # a cursor update lost in a crash must not cause numbers to be
+        # issued twice once the journal is recovered on restart.
+        ListBasedRegion.objects.filter(pk=self.list_based_region.pk).update(
+            last_number_line=6)
+        cursor.recover(self.list_based_region)
+        response = self.generate_allocation(5, self.test_pool,
+                                            self.list_based_region)
+        self.assertEqual(index.read_lines(self.list_based_region.file_path,
+                                          16, 5), response.number_list)
+        os.remove(cursor.get_journal_path(self.list_based_region))
+
+    def test_journal_failed_read_releases_lines(self):
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='cursor_mode', value='journal')
+        self.addCleanup(os.remove,
+                        cursor.get_journal_path(self.list_based_region))
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        with mock.patch.object(ThirdPartyProcessingClass, 'read_lines',
+                               side_effect=OSError):
+            with self.assertRaises(OSError):
+                ThirdPartyProcessingClass().get_items(
+                    self.list_based_region, 5)
+        self.list_based_region.refresh_from_db()
+        self.assertEqual(6, self.list_based_region.last_number_line)
+        # the journal was rolled back too, so the lines are issued next.
+        self.assertEqual(index.read_lines(self.list_based_region.file_path,
+                                          6, 5),
+                         ThirdPartyProcessingClass().get_items(
+                             self.list_based_region, 5))
+
     def test_uuid_pool_correct_numbers_returned(self):
         response = self.generate_allocation(5, self.test_pool,
                                             self.list_based_region)
@@ -345,11 +957,13 @@ class UUIDPoolDBTest(TestCase):
                                                       self.rule, self.template)
 
     def tearDown(self):
-        try:
-            os.remove(self.list_based_region.file_path)
-        except:
-            # some tests don't use filesystem.
-            pass
+        for path in (self.list_based_region.file_path,
+                     index.get_index_path(self.list_based_region.file_path)):
+            try:
+                os.remove(path)
+            except:
+                # some tests don't use filesystem.
+                pass
 
     def generate_test_pool(self):
         # create pool
@@ -449,6 +1063,405 @@ class UUIDPoolDBTest(TestCase):
                                 (get_region_table(self.list_based_region), rowcount))
         return result.fetchall()
 
+    def test_short_claim_deletes_nothing(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        self.assert_short_claim_changes_nothing(DBProcessingClass())
+        first = self.get_rows(3)
+        self.assertEqual([row[0] for row in first], DBProcessingClass(
+        ).get_items(self.list_based_region, 3))
+
+    def assert_short_claim_changes_nothing(self, processing_class):
+        statements = []
+        connection = sqlite.get_region_connection(self.list_based_region)
+        connection.set_trace_callback(statements.append)
+        self.addCleanup(connection.set_trace_callback, None)
+        with self.assertRaises(ValueError):
+            processing_class.get_items(self.list_based_region, 500)
+        # the claim statement never ran.
+        self.assertFalse([statement for statement in statements
+                          if statement.startswith(('DELETE', 'UPDATE'))])
+        self.assertEqual(195,
+                         get_region_db_number_count(self.list_based_region))
+
+    def test_short_mark_used_claim_marks_nothing(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='claim_mode', value='mark')
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        self.list_based_region.refresh_from_db()
+        self.assert_short_claim_changes_nothing(DBProcessingClass())
+        self.assertEqual(5, sqlite.get_region_connection(
+            self.list_based_region).execute(
+            'SELECT count(*) FROM %s WHERE used = 1' % get_region_table(
+                self.list_based_region)).fetchone()[0])
+
+    def test_tuning_profile(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='sqlite_profile', value='throughput')
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='sqlite_synchronous', value='full')
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        connection = sqlite.get_region_connection(self.list_based_region)
+        # FULL overrides the profile's NORMAL, the rest comes from it.
+        self.assertEqual(2, connection.execute(
+            'PRAGMA synchronous').fetchone()[0])
+        self.assertEqual(2, connection.execute(
+            'PRAGMA temp_store').fetchone()[0])
+        self.assertEqual('wal', connection.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='sqlite_mmap_size', value='1; DROP TABLE x')
+        self.list_based_region.refresh_from_db()
+        with self.assertRaises(ValueError):
+            sqlite.get_region_connection(self.list_based_region)
+
+    def test_mark_used_claims(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='claim_mode', value='mark')
+        first = self.generate_allocation(5, self.test_pool,
+                                         self.list_based_region).number_list
+        second = self.generate_allocation(5, self.test_pool,
+                                          self.list_based_region).number_list
+        self.assertEqual(190,
+                         get_region_db_number_count(self.list_based_region))
+        rows = self.get_rows(200)
+        self.assertEqual(200, len(rows))
+        self.assertEqual(first + second,
+                         [row[0] for row in rows if row[1] == 1])
+
+    def test_upgrade_existing_database(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        table = get_region_table(self.list_based_region)
+        legacy = sqlite3.connect(self.list_based_region.db_file_path)
+        legacy.execute('create table %s (serial_number text not null '
+                       'unique, used integer not null)' % table)
+        legacy.executemany('insert into %s values (?, ?)' % table,
+                           [(str(i), int(i < 998)) for i in range(1000)])
+        legacy.commit()
+        legacy.close()
+        call_command('upgrade_db_region',
+                     self.list_based_region.machine_name)
+        plan = sqlite.get_region_connection(self.list_based_region).execute(
+            'explain query plan select rowid, serial_number from %s '
+            'where used = 0 order by rowid limit 1' % table).fetchall()
+        self.assertIn('%s_UNUSED' % table, str(plan))
+        self.assertEqual(2,
+                         get_region_db_number_count(self.list_based_region))
+
+    def test_vacuum(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        table = get_region_table(self.list_based_region)
+        legacy = sqlite3.connect(self.list_based_region.db_file_path)
+        legacy.execute('create table %s (serial_number text not null '
+                       'unique, used integer not null)' % table)
+        legacy.executemany('insert into %s values (?, 0)' % table,
+                           [(str(uuid.uuid1()),) for i in range(5000)])
+        legacy.commit()
+        legacy.close()
+        DBProcessingClass().get_items(self.list_based_region, 2500)
+        # the legacy database can't reclaim pages incrementally
+        self.assertEqual(0, vacuum_db_region(
+            self.list_based_region)['reclaimed_pages'])
+        metrics = vacuum_db_region(self.list_based_region, full=True)
+        self.assertGreater(metrics['reclaimed_pages'], 0)
+        self.assertEqual(0, metrics['free_pages'])
+        DBProcessingClass().get_items(self.list_based_region, 100)
+        # SQLite before 3.27 falls back to a plain VACUUM.
+        with mock.patch.object(vacuum, 'SUPPORTS_VACUUM_INTO', False):
+            metrics = vacuum_db_region(self.list_based_region, full=True)
+        self.assertGreater(metrics['reclaimed_pages'], 0)
+        self.assertEqual(0, metrics['free_pages'])
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='vacuum_pages', value='5')
+        self.list_based_region.refresh_from_db()
+        DBProcessingClass().get_items(self.list_based_region, 2000)
+        free_pages = vacuum_db_region(self.list_based_region,
+                                      0)['free_pages']
+        self.assertGreater(free_pages, 5)
+        ReclaimFreePages().execute(None, self.test_pool,
+                                   self.list_based_region, 0)
+        metrics = vacuum_db_region(self.list_based_region, 0)
+        self.assertEqual(free_pages - 5, metrics['free_pages'])
+        self.assertEqual(400,
+                         get_region_db_number_count(self.list_based_region))
+
+    def test_sharded_region(self):
+        self.list_based_region.processing_class_path = (
+            'list_based_flavorpack.processing_classes.third_party_processing.'
+            'processing.ShardedDBProcessingClass')
+        self.list_based_region.save()
+        Step.objects.filter(rule=self.rule).update(
+            step_class='list_based_flavorpack.steps.ShardedUUIDRequestDBStep')
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='shard_count', value='3')
+        paths = sqlite.get_shard_paths(self.list_based_region)
+        for path in paths:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        self.addCleanup(lambda: [os.remove(path) for path in paths])
+        table = get_region_table(self.list_based_region)
+        first = self.generate_allocation(5, self.test_pool,
+                                         self.list_based_region).number_list
+        inventory = [sqlite.get_inventory(sqlite.get_connection(path), table)
+                     for path in paths]
+        self.assertEqual(195, sum(inventory))
+        # 67, 67 and 66 were ingested, less the 5 claimed from one shard
+        self.assertLessEqual(max(inventory) - min(inventory), 6)
+        # a shard whose writer lock is held is skipped
+        busy = sqlite3.connect(paths[0])
+        busy.execute('BEGIN IMMEDIATE')
+        second = ShardedDBProcessingClass().get_items(
+            self.list_based_region, 100)
+        busy.rollback()
+        busy.close()
+        self.assertEqual(inventory[0], sqlite.get_inventory(
+            sqlite.get_connection(paths[0]), table))
+        self.assertEqual(105, len(set(first + second)))
+        self.assertEqual(95, SufficientShardedDBNumbers().get_available_count(
+            self.list_based_region))
+        statements = []
+        for path in paths:
+            connection = sqlite.get_region_connection(self.list_based_region,
+                                                      path)
+            connection.set_trace_callback(statements.append)
+            self.addCleanup(connection.set_trace_callback, None)
+        with self.assertRaises(ValueError):
+            ShardedDBProcessingClass().get_items(self.list_based_region, 96)
+        self.assertFalse([statement for statement in statements
+                          if statement.startswith(('DELETE', 'UPDATE'))])
+        # a small replenishment goes to the emptiest shard.
+        self.list_based_region.refresh_from_db()
+        inventory = [sqlite.get_inventory(sqlite.get_connection(path), table)
+                     for path in paths]
+        ShardedUUIDRequestDBStep(None).persist_data(self.list_based_region,
+                                                    1)
+        emptiest = inventory.index(min(inventory))
+        inventory[emptiest] += 1
+        self.assertEqual(inventory, [
+            sqlite.get_inventory(sqlite.get_connection(path), table)
+            for path in paths])
+
+    def test_orm_region(self):
+        self.list_based_region.processing_class_path = (
+            'list_based_flavorpack.processing_classes.third_party_processing.'
+            'processing.ORMProcessingClass')
+        self.list_based_region.save()
+        Step.objects.filter(rule=self.rule).update(
+            step_class='list_based_flavorpack.steps.ORMUUIDRequestStep')
+        StepParameter.objects.create(
+            step=Step.objects.get(rule=self.rule), name='chunk-size',
+            value='30')
+        first = self.generate_allocation(5, self.test_pool,
+                                         self.list_based_region).number_list
+        numbers = ListBasedNumber.objects.filter(
+            list_based_region=self.list_based_region).order_by('sequence')
+        self.assertEqual(195, numbers.count())
+        self.assertEqual(list(range(6, 201)),
+                         list(numbers.values_list('sequence', flat=True)))
+        expected = list(numbers.values_list('serial_number', flat=True))
+        second = self.generate_allocation(300, self.test_pool,
+                                          self.list_based_region).number_list
+        self.assertEqual(expected, second[:195])
+        self.assertEqual(305, len(set(first + second)))
+        self.assertEqual(95, numbers.count())
+        with self.assertRaises(ValueError):
+            ORMProcessingClass().get_items(self.list_based_region, 96)
+        self.assertEqual(95, numbers.count())
+        # rows skipped because a concurrent claim held them are waited on
+        # before the request is treated as short.
+        select_rows = ORMProcessingClass.select_rows
+        remaining = list(numbers.values_list('serial_number', flat=True)[:10])
+        with mock.patch.object(
+                ORMProcessingClass, 'select_rows', autospec=True,
+                side_effect=lambda self, region, size, skip_locked:
+                [] if skip_locked else select_rows(self, region, size,
+                                                   skip_locked)):
+            self.assertEqual(remaining, ORMProcessingClass().get_items(
+                self.list_based_region, 10))
+        self.assertEqual(85, numbers.count())
+
+    def test_prefetch_buffer(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        self.addCleanup(prefetch.release, self.list_based_region)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='prefetch_size', value='50')
+        shutdown = ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='prefetch_shutdown', value='return')
+        first = self.generate_allocation(5, self.test_pool,
+                                         self.list_based_region).number_list
+        self.assertEqual(150,
+                         get_region_db_number_count(self.list_based_region))
+        second = self.generate_allocation(40, self.test_pool,
+                                          self.list_based_region).number_list
+        # served from memory
+        self.assertEqual(150,
+                         get_region_db_number_count(self.list_based_region))
+        self.assertEqual(5, prefetch.get_buffered_count(
+            self.list_based_region))
+        self.assertEqual(45, len(set(first + second)))
+        self.assertEqual(5, prefetch.release(self.list_based_region))
+        self.assertEqual(155,
+                         get_region_db_number_count(self.list_based_region))
+        shutdown.value = 'write_off'
+        shutdown.save()
+        third = self.generate_allocation(10, self.test_pool,
+                                         self.list_based_region).number_list
+        self.assertEqual(55, len(set(first + second + third)))
+        self.assertEqual(0, prefetch.release(self.list_based_region))
+        self.assertEqual(105,
+                         get_region_db_number_count(self.list_based_region))
+
+    def test_prefetch_release_after_failed_claim(self):
+        self.addCleanup(prefetch.release, self.list_based_region)
+        processing_instance = mock.Mock(**{
+            'get_pre_processing_rules.return_value': [],
+            'get_items.side_effect': OSError})
+        with self.assertRaises(OSError):
+            prefetch.get_items(self.list_based_region, processing_instance,
+                               5, 50)
+        with mock.patch.object(prefetch.logger, 'exception') as log:
+            prefetch.release_all()
+        log.assert_not_called()
+
+    def test_prefetch_return_to_orm(self):
+        self.list_based_region.processing_class_path = (
+            'list_based_flavorpack.processing_classes.third_party_processing.'
+            'processing.ORMProcessingClass')
+        self.list_based_region.save()
+        Step.objects.filter(rule=self.rule).update(
+            step_class='list_based_flavorpack.steps.ORMUUIDRequestStep')
+        self.addCleanup(prefetch.release, self.list_based_region)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='prefetch_size', value='50')
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='prefetch_shutdown', value='return')
+        first = self.generate_allocation(5, self.test_pool,
+                                         self.list_based_region).number_list
+        numbers = ListBasedNumber.objects.filter(
+            list_based_region=self.list_based_region).order_by('sequence')
+        buffered = [number for number in prefetch._buffers[
+            self.list_based_region.pk].numbers]
+        self.assertEqual(45, prefetch.release(self.list_based_region))
+        self.assertEqual(195, numbers.count())
+        # returned numbers are issued again first, in order
+        self.assertEqual(buffered, list(numbers.values_list(
+            'serial_number', flat=True)[:45]))
+        self.assertNotIn(first[0], buffered)
+
+    def test_low_watermark(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        ProcessingParameters.objects.create(
+            list_based_region=self.list_based_region,
+            key='low_watermark', value='150')
+        with mock.patch.object(replenishment, 'replenish_async') as queue:
+            self.generate_allocation(5, self.test_pool,
+                                     self.list_based_region)
+            queue.assert_not_called()
+            self.generate_allocation(50, self.test_pool,
+                                     self.list_based_region)
+            self.assertEqual(1, queue.call_count)
+        self.assertEqual(145,
+                         get_region_db_number_count(self.list_based_region))
+        self.assertTrue(replenishment.replenish(
+            SufficientDBNumbers, self.list_based_region.pk))
+        self.assertEqual(345,
+                         get_region_db_number_count(self.list_based_region))
+        self.assertFalse(replenishment.replenish(
+            SufficientDBNumbers, self.list_based_region.pk))
+
+    def test_single_background_replenishment(self):
+        with mock.patch.object(replenishment, '_get_executor') as executor:
+            self.assertTrue(replenishment.replenish_async(
+                SufficientDBNumbers(), self.list_based_region))
+            self.assertFalse(replenishment.replenish_async(
+                SufficientDBNumbers(), self.list_based_region))
+            self.assertEqual(1, executor().submit.call_count)
+            run = executor().submit.call_args[0]
+        with mock.patch.object(replenishment, 'replenish'), \
+                mock.patch.object(replenishment, 'connections'):
+            run[0](*run[1:])
+        self.assertNotIn(self.list_based_region.pk,
+                         replenishment._in_flight)
+
+    def test_forked_worker_resets_background_tasks(self):
+        with mock.patch.object(replenishment, '_get_executor'):
+            replenishment.replenish_async(SufficientDBNumbers(),
+                                          self.list_based_region)
+        self.addCleanup(replenishment._in_flight.clear)
+        pid = os.fork()
+        if not pid:
+            os._exit(0 if not replenishment._in_flight and
+                     replenishment._executor is None else 1)
+        self.assertEqual(0, os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]))
+
+    def test_single_flight_replenishment(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        region = self.list_based_region
+        ProcessingParameters.objects.create(
+            list_based_region=region, key='replenishment_timeout',
+            value='0.1')
+        ProcessingParameters.objects.create(
+            list_based_region=region, key='low_watermark', value='10')
+        rule = SufficientDBNumbers()
+        lock_path = replenishment.get_lock_path(region)
+        with mock.patch.object(SufficientDBNumbers,
+                               'fetch_more_numbers') as fetch:
+            with try_lock_file(lock_path) as acquired:
+                self.assertTrue(acquired)
+                with self.assertRaises(RuleError):
+                    rule.execute(None, self.test_pool, region, 5)
+                self.assertFalse(replenishment.replenish(
+                    SufficientDBNumbers, region.pk))
+            fetch.assert_not_called()
+
+            # a waiter uses the numbers of the replenishment it waited on
+            ready = threading.Event()
+
+            def replenish_elsewhere():
+                with try_lock_file(lock_path):
+                    ready.set()
+                    time.sleep(0.2)
+                    connection = sqlite.get_connection(region.db_file_path)
+                    sqlite.insert_numbers(connection,
+                                          get_region_table(region),
+                                          range(20))
+            thread = threading.Thread(target=replenish_elsewhere)
+            thread.start()
+            ready.wait()
+            ProcessingParameters.objects.filter(
+                key='replenishment_timeout').update(value='5')
+            region.refresh_from_db()
+            rule.execute(None, self.test_pool, region, 5)
+            thread.join()
+            fetch.assert_not_called()
+
+            rule.execute(None, self.test_pool, region, 25)
+            self.assertEqual(1, fetch.call_count)
+
     def test_replenish_twice(self):
         if os.path.exists(self.list_based_region.db_file_path):
             os.remove(self.list_based_region.db_file_path)
@@ -471,3 +1484,125 @@ class UUIDPoolDBTest(TestCase):
         self.assertEqual(100, len(response.number_list))
         row_count = get_region_db_number_count(self.list_based_region)
         self.assertEqual(175, row_count)
+
+    def batch_allocate(self, sizes):
+        request = APIRequestFactory().post('batch-allocate/', sizes,
+                                           format='json')
+        user = User.objects.filter(username='batch').first() or \
+            User.objects.create_superuser('batch', 'batch@example.com',
+                                          'batch')
+        force_authenticate(request, user=user)
+        return BatchAllocateView.as_view()(request)
+
+    def test_batch_allocate(self):
+        if os.path.exists(self.list_based_region.db_file_path):
+            os.remove(self.list_based_region.db_file_path)
+        second = ListBasedRegion.objects.create(
+            processing_class_path=self.list_based_region.processing_class_path,
+            pool=self.test_pool, readable_name="Case Region",
+            machine_name="CASE_REGION", active=True, order=2, rule=self.rule,
+            template=self.template, number_replenishment_size=100,
+            directory_path="/tmp")
+        try:
+            response = self.batch_allocate({
+                self.list_based_region.machine_name: 5,
+                "CASE_REGION": 3,
+                "NO_SUCH_REGION": 1})
+        finally:
+            os.remove(second.db_file_path)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(5, len(response.data[
+            self.list_based_region.machine_name]['numbers'].split(',')))
+        self.assertEqual(3, len(response.data['CASE_REGION'][
+            'numbers'].split(',')))
+        self.assertEqual(404, response.data['NO_SUCH_REGION']['status_code'])
+        self.assertEqual(195,
+                         get_region_db_number_count(self.list_based_region))
+        self.assertEqual(2, sb_models.Response.objects.count())
+
+    def test_batch_allocate_reports_failures(self):
+        def allocate(generator, request, size, region):
+            if size > 10:
+                raise ValueError("There are not enough numbers to satisfy "
+                                 "the request.")
+            response = sb_models.Response(region=region.machine_name,
+                                          pool=region.pool.machine_name,
+                                          size_granted=size, fulfilled=True)
+            response.number_list = ['1'] * size
+            return response
+        ListBasedRegion.objects.create(pool=self.test_pool,
+                                       readable_name="Case Region",
+                                       machine_name="CASE_REGION",
+                                       active=True, order=2)
+        with mock.patch.object(batch, 'runs_concurrently',
+                               return_value=True), \
+                mock.patch(
+                    'list_based_flavorpack.generators.list_based.'
+                    'ListBasedGenerator.allocate', allocate):
+            response = self.batch_allocate({
+                self.list_based_region.machine_name: 5,
+                "CASE_REGION": 50})
+        self.assertEqual(str(['1'] * 5), response.data[
+            self.list_based_region.machine_name]['numbers'])
+        self.assertEqual({'error': "There are not enough numbers to satisfy "
+                                   "the request.", 'status_code': 500},
+                         response.data['CASE_REGION'])
+        self.assertEqual(400, self.batch_allocate(
+            {"CASE_REGION": -1}).status_code)
+
+    def allocate_with_strategy(self, strategy):
+        PoolAllocationStrategy.objects.create(pool=self.test_pool,
+                                              strategy=strategy)
+        second = ListBasedRegion.objects.create(
+            processing_class_path=self.list_based_region.processing_class_path,
+            pool=self.test_pool, readable_name="Second Region",
+            machine_name="SECOND_REGION", active=True, order=2,
+            rule=self.rule, template=self.template,
+            number_replenishment_size=100, directory_path="/tmp")
+        self.addCleanup(os.remove, second.db_file_path)
+        generator = get_generator(self.test_pool.machine_name)
+        request = RequestFactory().get("allocate/TestPool/5")
+        # fills the second region with 100 numbers.
+        generator.get_response(request, 5, self.test_pool.machine_name,
+                               "SECOND_REGION")
+        return [generator.get_response(request, 5,
+                                       self.test_pool.machine_name).region
+                for i in range(3)]
+
+    def test_failover_strategy(self):
+        # the first region is empty, so the second serves without waiting.
+        self.assertEqual(["SECOND_REGION"] * 3, self.allocate_with_strategy(
+            PoolAllocationStrategy.FAILOVER))
+        self.assertEqual(0, get_region_db_number_count(self.list_based_region))
+
+    def test_round_robin_strategy(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        regions = self.allocate_with_strategy(
+            PoolAllocationStrategy.ROUND_ROBIN)
+        self.assertEqual(2, len(set(regions)))
+        self.assertNotEqual(regions[0], regions[1])
+        self.assertNotEqual(regions[1], regions[2])
+
+    def test_most_inventory_strategy(self):
+        # the first region holds 195 numbers, the second 95.
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        self.assertEqual([self.list_based_region.machine_name] * 3,
+                         self.allocate_with_strategy(
+                             PoolAllocationStrategy.MOST_INVENTORY))
+
+    def test_failover_after_issue_is_not_retried(self):
+        self.generate_allocation(5, self.test_pool, self.list_based_region)
+        self.allocate_with_strategy(PoolAllocationStrategy.FAILOVER)
+        second = ListBasedRegion.objects.get(machine_name="SECOND_REGION")
+        available = get_region_db_number_count(second)
+        generator = get_generator(self.test_pool.machine_name)
+        with mock.patch.object(generator, '_execute_post_processing_rules',
+                               side_effect=OSError):
+            with self.assertRaises(OSError):
+                generator.get_response(RequestFactory().get("allocate/"), 5,
+                                       self.test_pool.machine_name)
+        self.assertEqual(available, get_region_db_number_count(second))
+
+    def test_regions_without_storage_rule_are_unbounded(self):
+        self.assertEqual(float('inf'), strategies.get_available_count(
+            self.list_based_region, VanillaProcessingClass))